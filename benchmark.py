@@ -0,0 +1,166 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import main
+
+BASE_WORLD = {"bushes": 50, "grass_patches": 75, "preys": 50, "predators": 4}
+
+def build_world(scale, seed, dense=False):
+    # the world grows with the population so density stays the same, unless dense keeps it screen sized
+    side = 1 if dense else math.sqrt(scale)
+    simulation = main.Simulation(seed=seed, populate=False,
+                                 world_width=round(main.WORLD_WIDTH * side), world_height=round(main.WORLD_HEIGHT * side))
+    simulation.populate(**{name: count * scale for name, count in BASE_WORLD.items()})
+    return simulation
+
+def world_counts(simulation):
+    return dict(zip(["preys", "predators", "bushes", "grass_patches"], simulation.population_counts()))
+
+def time_calls(function, arguments, repeat):
+    # best of repeat passes over every argument, in microseconds per call
+    if not arguments:
+        return None
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for argument in arguments:
+            function(*argument)
+        best = min(best, time.perf_counter() - start)
+    return best / len(arguments) * 1e6
+
+def benchmark_kernels(simulation, repeat, delta_time):
+    controller = simulation.prey_social_controller
+    phases = simulation.phases
+    preys = list(simulation.preys)
+    animals = preys + list(simulation.predators)
+    plant_grid = simulation.plant_spatial_grid
+    positions = [main.random_int_xy([1, simulation.world_width - 1], [1, simulation.world_height - 1], simulation.random) for _ in range(1000)]
+
+    # kernels that write velocities or targets run on this world after the step benchmark,
+    # on_hungry gets a zero delta time so eating does not remove anything; it walks through the
+    # sense phase buffers, so it is timed over a whole sense pass and divided per animal
+    on_hungry = time_calls(lambda: phases.sense(animals, lambda animal: animal.on_hungry(0)), [()], repeat)
+    phases.act()
+    return {
+        "flock": time_calls(controller.flock, [(prey, delta_time) for prey in preys], repeat),
+        "flock_all": time_calls(controller.flock_all, [(delta_time,)], repeat),
+        "avoid_predators": time_calls(controller.avoid_predators, [(prey, delta_time) for prey in preys], repeat),
+        "on_hungry": on_hungry / len(animals) if animals else None,
+        "get_nearby_sprites": time_calls(plant_grid.get_nearby_sprites, [(prey.center_x, prey.center_y) for prey in preys], repeat),
+        "can_add_plant": time_calls(simulation.can_add_plant, positions, repeat),
+    }
+
+def benchmark_scale(scale, args):
+    simulation = build_world(scale, args.seed, args.dense)
+    result = {"scale": scale, "entities": len(simulation.entities), "counts": world_counts(simulation)}
+
+    simulation.run(args.warmup, args.delta_time)
+
+    start = time.perf_counter()
+    simulation.run(args.ticks, args.delta_time)
+    elapsed = time.perf_counter() - start
+    result["ticks_per_second"] = args.ticks / elapsed
+
+    # the phase breakdown gets ticks of its own, the profiler's clock reads would skew the throughput above
+    profiler = simulation.start_profiling()
+    simulation.run(args.ticks, args.delta_time)
+    profiler.enabled = False
+    result["phases_ms"] = {phase: stats["mean"] for phase, stats in profiler.summary().items()}
+    result["kernels_us"] = benchmark_kernels(simulation, args.repeat, args.delta_time)
+
+    # tracemalloc slows everything down, so memory gets its own run of the same world
+    tracemalloc.start()
+    simulation = build_world(scale, args.seed, args.dense)
+    simulation.run(args.memory_ticks, args.delta_time)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["peak_memory_mb"] = peak / 2 ** 20
+
+    return result
+
+def compare(results, baseline, tolerance):
+    # prints the ratio of every metric to the baseline, returns the regressions beyond tolerance
+    baseline_by_scale = {result["scale"]: result for result in baseline["results"]}
+    regressions = []
+
+    for result in results["results"]:
+        reference = baseline_by_scale.get(result["scale"])
+        if reference is None:
+            print(f"scale {result['scale']}: not in baseline")
+            continue
+
+        metrics = [("ticks_per_second", result["ticks_per_second"], reference["ticks_per_second"], True),
+                   ("peak_memory_mb", result["peak_memory_mb"], reference["peak_memory_mb"], False)]
+        for group in ("phases_ms", "kernels_us"):
+            for name, value in result[group].items():
+                if value is not None and reference[group].get(name) is not None:
+                    metrics.append((f"{group}.{name}", value, reference[group][name], False))
+
+        print(f"scale {result['scale']} ({result['entities']} entities):")
+        for name, value, reference_value, higher_is_better in metrics:
+            ratio = value / reference_value if reference_value else float("inf")
+            worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+            marker = "  REGRESSION" if worse else ""
+            print(f"  {name:<40} {reference_value:12.3f} -> {value:12.3f}  x{ratio:.2f}{marker}")
+            if worse:
+                regressions.append((result["scale"], name, ratio))
+
+    return regressions
+
+def print_result(result):
+    kernels = ", ".join(f"{name} {value:.1f}us" for name, value in result["kernels_us"].items() if value is not None)
+    print(f"scale {result['scale']}: {result['entities']} entities, {result['ticks_per_second']:.1f} ticks/s, "
+          f"peak {result['peak_memory_mb']:.1f} MB - {kernels}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ecosystem simulator at increasing world sizes")
+    parser.add_argument("--scales", default="1,4,16,64",
+                        help="comma separated multipliers of the default world (50 preys, 4 predators, 50 bushes, 75 grass), "
+                             "256 gives about 33k entities")
+    parser.add_argument("--dense", action="store_true", help="keep the world screen sized instead of growing it with the population")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ticks", type=int, default=100, help="measured ticks per scale")
+    parser.add_argument("--warmup", type=int, default=10, help="ticks run before measuring")
+    parser.add_argument("--memory-ticks", type=int, default=10, help="ticks run under tracemalloc for the peak memory")
+    parser.add_argument("--repeat", type=int, default=3, help="passes per kernel, the best one is kept")
+    parser.add_argument("--delta-time", type=float, default=1 / 60)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a previous output and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative slowdown tolerated by --compare")
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "dense": args.dense,
+        "ticks": args.ticks,
+        "delta_time": args.delta_time,
+        "results": [],
+    }
+
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        result = benchmark_scale(scale, args)
+        results["results"].append(result)
+        print_result(result)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
@@ -1,12 +1,46 @@
 import arcade
 import arcade.key
+import argparse
+import collections
+import concurrent.futures
+import functools
+import gc
+import hashlib
+import heapq
+import itertools
+import json
 import random
 import math
+import os
+import queue
+import sys
+import threading
 import time
-from enum import Enum
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import pyglet.graphics
+from enum import Enum, IntEnum
 
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 720
+WORLD_WIDTH = SCREEN_WIDTH
+WORLD_HEIGHT = SCREEN_HEIGHT
+
+CAMERA_PAN_SPEED = 600
+CAMERA_ZOOM_STEP = 1.1
+CAMERA_MIN_ZOOM = 0.05
+CAMERA_MAX_ZOOM = 4
+# room around the viewport so overlays of entities just outside it still show
+CULLING_MARGIN = 60
+CHUNK_SLEEP_TICKS = 8
+PARALLEL_PARTITIONS = 16
+
+SIMULATION_TIMESTEP = 1 / 60
+# simulated seconds per real second, None steps as fast as UPDATE_TIME_BUDGET allows
+SIMULATION_SPEEDS = [1, 4, 16, None]
+UPDATE_TIME_BUDGET = 1 / 30
+MAX_FRAME_TIME = 0.25
 
 HEALTH_BAR_WIDTH = 50
 HEALTH_BAR_HEIGHT = 10
@@ -25,6 +59,7 @@ GRID_OFFSET_Y = SCREEN_HEIGHT / GRID_UNIT_Y
 IDDLE_TIME = 5
 INTERACT_RANGE = 40
 DETECTION_RANGE = 120
+PREY_DETECTION_RANGE = math.sqrt(DETECTION_RANGE * DETECTION_RANGE + 25)
 
 FOX_MOVEMENT_SPEED = 20
 FOX_RUNNING_SPEED = 60
@@ -45,11 +80,18 @@ PLANT_REPRODUCTIVE_INTERVAL = 150
 PLANT_LIFE_EXPECTANCY = 300
 PLANT_HEALTH = 5
 PLANT_NUTRIENT_RADIUS = 80
+# live plants tolerated in the nutrient cells around a new bush, and spots a new grass patch picks the sparsest of
+PLANT_CROWDING_LIMIT = 5
+GRASS_SPAWN_CANDIDATES = 2
 
 CARD_IMAGE = "images/entities/base-card.png"
 CARD_TYPES = ["create_rabbit", "create_fox", "create_bush", "create_grass", "global_heal", "hungry_rabbit"]
 CARD_COST_TYPES = ["rabbit", "fox", "bush", "grass"]
 
+CHECKPOINT_VERSION = 5
+CHECKPOINT_PATH = "checkpoint"
+PROFILE_PATH = "profile.json"
+
 class AnimalRoutine(Enum):
     HUNGRY = 0
     IDDLE_TIME = 1
@@ -60,108 +102,900 @@ class PlantRoutine(Enum):
     REPRODUCTIVE_INTERVAL = 0
     LIFE_EXPECTANCY = 1
 
-class LivingBeingStates(Enum):
+# bit of each routine in LivingBeing.due_routines, tested on every update so the enum values are looked up once here
+HUNGRY_DUE = 1 << AnimalRoutine.HUNGRY.value
+IDDLE_TIME_DUE = 1 << AnimalRoutine.IDDLE_TIME.value
+ANIMAL_REPRODUCTIVE_DUE = 1 << AnimalRoutine.REPRODUCTIVE_INTERVAL.value
+ANIMAL_LIFE_EXPECTANCY_DUE = 1 << AnimalRoutine.LIFE_EXPECTANCY.value
+PLANT_REPRODUCTIVE_DUE = 1 << PlantRoutine.REPRODUCTIVE_INTERVAL.value
+PLANT_LIFE_EXPECTANCY_DUE = 1 << PlantRoutine.LIFE_EXPECTANCY.value
+
+# a state's value is its code in the entity store and in the transition tables,
+# the states both enums share have the same code so they compare equal
+class LivingBeingStates(IntEnum):
     EATING = 3
     REPRODUCING = 4
     DEAD = 5
-    STARVING = 6,
+    STARVING = 6
     NORMAL = 7
 
-class AnimalStates(Enum):
+class AnimalStates(IntEnum):
     WALKING = 1
     RUNNING = 2
-    EATING = LivingBeingStates.EATING
-    REPRODUCING = LivingBeingStates.REPRODUCING
-    DEAD = LivingBeingStates.DEAD,
-    PURSUE_FOOD = LivingBeingStates.STARVING
+    EATING = LivingBeingStates.EATING.value
+    REPRODUCING = LivingBeingStates.REPRODUCING.value
+    DEAD = LivingBeingStates.DEAD.value
+    PURSUE_FOOD = LivingBeingStates.STARVING.value
 
 class LivingType(Enum):
     RABBIT = 1
-    FOX = 2,
-    PLANT = 3,
+    FOX = 2
+    PLANT = 3
     GRASS = 4
 
+# code 0 is an entity without a state, a code both enums have maps to the LivingBeingStates member
+STATE_COUNT = max(LivingBeingStates) + 1
+STATE_MEMBERS = [next((state for state in [*LivingBeingStates, *AnimalStates] if state == code), None) for code in range(STATE_COUNT)]
+STATE_CODES = {state: 0 if state is None else state.value for state in [None, *AnimalStates, *LivingBeingStates]}
+LIVING_TYPE_CODES = {living_type: code for code, living_type in enumerate(LivingType)}
+PLANT_TYPES = (LivingType.PLANT, LivingType.GRASS)
+
+DEAD_STATES = (LivingBeingStates.DEAD,)
+
+def transition_table(transitions):
+    # table[current, new] is True when apply_state may go from current to new
+    table = np.zeros((STATE_COUNT, STATE_COUNT), dtype=np.bool_)
+    for current_state, new_states in transitions.items():
+        table[current_state, list(new_states)] = True
+    return table
+
+# a hungry animal only gives up food by eating or dying, and the dead stay dead;
+# the resting state and death are also written directly by clear_state and the life expectancy
+ANIMAL_TRANSITIONS = transition_table({
+    AnimalStates.WALKING: (AnimalStates.PURSUE_FOOD, AnimalStates.REPRODUCING, AnimalStates.DEAD),
+    AnimalStates.REPRODUCING: (AnimalStates.WALKING, AnimalStates.PURSUE_FOOD, AnimalStates.DEAD),
+    AnimalStates.PURSUE_FOOD: (AnimalStates.DEAD,),
+})
+PLANT_TRANSITIONS = transition_table({
+    LivingBeingStates.NORMAL: (LivingBeingStates.REPRODUCING, LivingBeingStates.DEAD),
+    LivingBeingStates.REPRODUCING: (LivingBeingStates.NORMAL, LivingBeingStates.DEAD),
+})
+
+NO_TARGET = -1
+DETACHED_TARGET = -2
+
+STRATEGIES = [None, 'forage_open', 'forage_cover', 'active_hunt', 'ambush']
+ANIMAL_TELEMETRY_STATES = [AnimalStates.WALKING, AnimalStates.PURSUE_FOOD, AnimalStates.REPRODUCING]
+PLANT_TELEMETRY_STATES = [LivingBeingStates.NORMAL, LivingBeingStates.REPRODUCING]
+CHECKPOINT_STORE_COLUMNS = ["x", "y", "vx", "vy", "health", "timers", "experience", "state", "kind", "target"]
+CHECKPOINT_EXTRA_COLUMNS = ["slot", "due_routines", "bar_health", "last_damage_time", "life_expectancy", "sleep_debt",
+                            "movement_speed", "hungry_time_to_fulfill", "target_coord", "target_row", "strategy",
+                            "grid_order", "alive_order", "state_order"]
+# the columns restore_entities reads into entity attributes, the others go to the store or are ordered in bulk
+CHECKPOINT_ENTITY_COLUMNS = ["x", "y", "health", "state", "kind", "slot", "due_routines", "bar_health", "last_damage_time",
+                             "life_expectancy", "sleep_debt", "movement_speed", "hungry_time_to_fulfill", "target_row",
+                             "strategy"]
+
+class MirroredField:
+    # value lives in the instance dict so reads cost nothing, writes are mirrored to an EntityStore column
+    def __init__(self, column, encode=None):
+        self.column = column
+        self.encode = encode
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __set__(self, entity, value):
+        entity.__dict__[self.name] = value
+        if entity.slot is not None:
+            getattr(entity.store, self.column)[entity.slot] = self.encode(value) if self.encode else value
+
+    def value_of(self, entity):
+        return entity.__dict__[self.name]
+
+    def attach(self, entity):
+        pass
+
+    def detach(self, entity):
+        pass
+
+class StateField(MirroredField):
+    # also reports every state change of a spawned entity to the population registry
+    def __init__(self):
+        super().__init__("state", encode=STATE_CODES.__getitem__)
+
+    def __set__(self, entity, value):
+        if entity.slot is not None:
+            simulation = entity.simulation
+            previous_state = entity.__dict__[self.name]
+            if simulation.sensing:
+                # a death stays invisible to the other entities until the act phase
+                if value in DEAD_STATES:
+                    return simulation.phases.defer(self.__set__, entity, value)
+                if previous_state != value:
+                    simulation.phases.defer(simulation.population.on_state_change, entity, previous_state, value)
+            elif previous_state != value:
+                simulation.population.on_state_change(entity, previous_state, value)
+
+        super().__set__(entity, value)
+
+class StoreField(MirroredField):
+    # value lives in the EntityStore column while the entity owns a slot, so vectorized
+    # writes are seen by the entity; it falls back to the instance before spawn and after removal
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+
+        if entity.slot is None:
+            return entity.__dict__[self.name]
+
+        return getattr(entity.store, self.column)[entity.slot]
+
+    def __set__(self, entity, value):
+        if entity.slot is None:
+            entity.__dict__[self.name] = value
+        else:
+            getattr(entity.store, self.column)[entity.slot] = value
+
+    def value_of(self, entity):
+        return self.__get__(entity)
+
+    def attach(self, entity):
+        # the store holds the value from now on
+        entity.__dict__.pop(self.name, None)
+
+    def detach(self, entity):
+        value = self.__get__(entity)
+        entity.__dict__[self.name] = value.copy() if isinstance(value, np.ndarray) else value
+
+class RowField(StoreField):
+    # fixed size per entity container as a row view of a two dimensional column
+    def __init__(self, column, size):
+        super().__init__(column)
+        self.size = size
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+
+        if entity.slot is None:
+            return entity.__dict__[self.name]
+
+        return getattr(entity.store, self.column)[entity.slot, :self.size]
+
+    def __set__(self, entity, value):
+        if entity.slot is None:
+            entity.__dict__[self.name] = np.array(value, dtype=np.float64)
+        else:
+            getattr(entity.store, self.column)[entity.slot, :self.size] = value
+
+class TimersField(RowField):
+    # routine due times as a row view of the timers column
+    def __init__(self, routines):
+        super().__init__("timers", len(routines))
+
+class EntityStore:
+    COLUMNS = {
+        "x": (np.float64, ()),
+        "y": (np.float64, ()),
+        "vx": (np.float64, ()),
+        "vy": (np.float64, ()),
+        "health": (np.float64, ()),
+        "timers": (np.float64, (len(AnimalRoutine),)),
+        "experience": (np.float64, (2,)),
+        "state": (np.int32, ()),
+        "kind": (np.int32, ()),
+        "target": (np.int32, ()),
+        "alive": (np.bool_, ()),
+    }
+
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.size = 0
+        self.owners = []
+        self.free_slots = []
+        self.fields_by_class = {}
+
+        for column, (dtype, shape) in self.COLUMNS.items():
+            setattr(self, column, np.zeros((0,) + shape, dtype=dtype))
+
+        self.grow(capacity)
+
+    @staticmethod
+    def slot_of(entity):
+        if entity is None:
+            return NO_TARGET
+        if entity.slot is None:
+            return DETACHED_TARGET
+        return entity.slot
+
+    def grow(self, capacity):
+        for column, (dtype, shape) in self.COLUMNS.items():
+            old = getattr(self, column)
+            new = np.zeros((capacity,) + shape, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, column, new)
+
+        self.owners.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def fields_of(self, entity):
+        entity_class = type(entity)
+        if entity_class not in self.fields_by_class:
+            self.fields_by_class[entity_class] = [
+                field for klass in reversed(entity_class.__mro__)
+                for field in vars(klass).values() if isinstance(field, MirroredField)
+            ]
+        return self.fields_by_class[entity_class]
+
+    def allocate(self, entity):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.size == self.capacity:
+                self.grow(self.capacity * 2)
+            slot = self.size
+            self.size += 1
+
+        fields = self.fields_of(entity)
+        values = [(field, field.value_of(entity)) for field in fields]
+
+        self.owners[slot] = entity
+        self.alive[slot] = True
+        self.kind[slot] = LIVING_TYPE_CODES[entity.type]
+        self.x[slot], self.y[slot] = entity.position
+        self.vx[slot] = self.vy[slot] = 0
+        self.timers[slot] = 0
+        self.experience[slot] = 0
+        self.target[slot] = NO_TARGET
+
+        entity.store = self
+        entity.slot = slot
+        for field, value in values:
+            field.__set__(entity, value)
+            field.attach(entity)
+
+        return slot
+
+    def load_rows(self, entities, slots, columns, size, free_slots):
+        # bulk allocate for an empty store, every entity gets back the slot it was saved from
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        if capacity > self.capacity:
+            self.grow(capacity)
+
+        for column, values in columns.items():
+            getattr(self, column)[slots] = values
+        self.alive[slots] = True
+        self.size = size
+        self.free_slots = list(free_slots)
+
+        # the entities come from LivingBeing.restore and never set their store fields, so binding is all they need
+        owners = self.owners
+        for slot, entity in zip(slots, entities):
+            owners[slot] = entity
+            entity.store = self
+            entity.slot = slot
+
+    def detached_rows(self, entities):
+        # store columns of entities without a slot, from the values their fields fell back to
+        rows = {column: np.zeros((len(entities),) + shape, dtype=dtype) for column, (dtype, shape) in self.COLUMNS.items()}
+        for index, entity in enumerate(entities):
+            rows["x"][index], rows["y"][index] = entity.position
+            rows["kind"][index] = LIVING_TYPE_CODES[entity.type]
+            for field in self.fields_of(entity):
+                value = field.value_of(entity)
+                if field.encode:
+                    value = field.encode(value)
+                if isinstance(field, RowField):
+                    rows[field.column][index, :field.size] = value
+                else:
+                    rows[field.column][index] = value
+        return rows
+
+    def load_detached(self, entity, row):
+        # the store field values of an entity that stays without a slot
+        for field in self.fields_of(entity):
+            if isinstance(field, StoreField):
+                value = row[field.column]
+                field.__set__(entity, value[:field.size] if isinstance(field, RowField) else value)
+
+    def release(self, entity):
+        slot = entity.slot
+        if slot is None:
+            return
+
+        for field in self.fields_of(entity):
+            field.detach(entity)
+
+        entity.slot = None
+        self.owners[slot] = None
+        self.alive[slot] = False
+        self.target[:self.size][self.target[:self.size] == slot] = DETACHED_TARGET
+        self.free_slots.append(slot)
+
+    def push_positions(self, slots):
+        # the x and y columns are where positions change, allocate and load_rows fill them and this copies them to the sprites
+        owners = self.owners
+        for slot, x, y in zip(slots.tolist(), self.x[slots].tolist(), self.y[slots].tolist()):
+            owners[slot].position = (x, y)
+
+    def integrate_velocities(self, delta_time, living_type, width, height):
+        size = self.size
+        of_type = self.alive[:size] & (self.kind[:size] == LIVING_TYPE_CODES[living_type])
+
+        moving = np.flatnonzero(of_type & (self.target[:size] == NO_TARGET))
+        self.x[moving] += self.vx[moving] * delta_time
+        self.y[moving] += self.vy[moving] * delta_time
+
+        x, y = self.x[:size], self.y[:size]
+        self.vx[:size][of_type & ((x < 0) | (x > width))] *= -1
+        self.vy[:size][of_type & ((y < 0) | (y > height))] *= -1
+
+        return moving
+
+class PopulationRegistry:
+    # live sets per LivingType and per state, kept current by spawn, state change and removal events;
+    # live plants are also counted in the plant density raster
+    def __init__(self, plant_density=None):
+        self.alive = {living_type: {} for living_type in LivingType}
+        self.in_state = {living_type: {} for living_type in LivingType}
+        self.plant_density = plant_density
+
+    def on_spawn(self, entity):
+        if entity.current_state not in DEAD_STATES:
+            self._add_alive(entity)
+        self._enter_state(entity, entity.current_state)
+
+    def on_state_change(self, entity, previous_state, new_state):
+        self._leave_state(entity, previous_state)
+        self._enter_state(entity, new_state)
+
+        if new_state in DEAD_STATES:
+            self._remove_alive(entity)
+        elif previous_state in DEAD_STATES:
+            self._add_alive(entity)
+
+    def on_removed(self, entity):
+        self._remove_alive(entity)
+        self._leave_state(entity, entity.current_state)
+
+    def on_restored(self, alive, in_state):
+        # entities loaded from a checkpoint: alive maps a LivingType and in_state a (LivingType, state) pair
+        # to their members, in the iteration orders of the sets that were saved
+        for living_type, members in alive.items():
+            self.alive[living_type].update(dict.fromkeys(members))
+            if self.plant_density is not None and living_type in PLANT_TYPES:
+                self.plant_density.add_all(members)
+        for (living_type, state), members in in_state.items():
+            self.in_state[living_type].setdefault(state, {}).update(dict.fromkeys(members))
+
+    def count(self, living_type):
+        return len(self.alive[living_type])
+
+    def count_in_state(self, living_type, state):
+        return len(self.in_state[living_type].get(state, ()))
+
+    def members_in_state(self, living_type, state):
+        return list(self.in_state[living_type].get(state, ()))
+
+    def any_alive(self, *living_types):
+        return any(self.alive[living_type] for living_type in living_types)
+
+    def alive_of(self, *living_types):
+        for living_type in living_types:
+            yield from self.alive[living_type]
+
+    def _add_alive(self, entity):
+        self.alive[entity.type][entity] = None
+        if self.plant_density is not None and entity.type in PLANT_TYPES:
+            self.plant_density.add(entity)
+
+    def _remove_alive(self, entity):
+        self.alive[entity.type].pop(entity, None)
+        if self.plant_density is not None and entity.type in PLANT_TYPES:
+            self.plant_density.discard(entity)
+
+    def _enter_state(self, entity, state):
+        self.in_state[entity.type].setdefault(state, {})[entity] = None
+
+    def _leave_state(self, entity, state):
+        self.in_state[entity.type][state].pop(entity, None)
+
+class RoutineScheduler:
+    # heap of routine due times in simulation time, only entities whose timers expire get flagged on a tick
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.queue = []
+        self.sequence = itertools.count()
+
+    def schedule(self, entity, routine, due_time):
+        entity.due_times[routine] = due_time
+        bit = 1 << routine
+
+        if due_time < self.simulation.time:
+            entity.due_routines |= bit
+        else:
+            entity.due_routines &= ~bit
+            if self.simulation.sensing:
+                self.simulation.phases.defer(self.push, entity, routine, due_time)
+            else:
+                self.push(entity, routine, due_time)
+
+    def push(self, entity, routine, due_time):
+        heapq.heappush(self.queue, (due_time, next(self.sequence), routine, entity))
+
+    def advance(self, now):
+        queue = self.queue
+        while queue and queue[0][0] < now:
+            due_time, _, routine, entity = heapq.heappop(queue)
+
+            # entries left behind by a reschedule or a removed entity are just dropped
+            if entity.slot is not None and entity.due_times[routine] == due_time:
+                entity.due_routines |= 1 << routine
+
+class PlantDensity:
+    # live plants in the 3x3 PLANT_NUTRIENT_RADIUS cells around every cell of the world, changed by one block add
+    # on each plant birth and death, so placement reads how crowded a spot is in O(1) however many plants came and went;
+    # plants spawned off the world count in the nearest edge cell
+    def __init__(self, world_width, world_height, cell_size):
+        self.cell_size = cell_size
+        self.columns = int(world_width // cell_size) + 1
+        self.rows = int(world_height // cell_size) + 1
+        self.nearby = np.zeros((self.columns, self.rows), dtype=np.int32)
+        self.cells = {}
+
+    def cell_of(self, x, y):
+        column = min(max(int(x // self.cell_size), 0), self.columns - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return column, row
+
+    def add(self, plant):
+        if plant in self.cells:
+            return
+        cell = self.cell_of(plant.center_x, plant.center_y)
+        self.cells[plant] = cell
+        self._change(cell, 1)
+
+    def add_all(self, plants):
+        # add for many plants at once, every cell gets the plants of its 3x3 block in one pass
+        plants = [plant for plant in plants if plant not in self.cells]
+        if not plants:
+            return
+
+        x = np.array([plant.center_x for plant in plants], dtype=np.float64)
+        y = np.array([plant.center_y for plant in plants], dtype=np.float64)
+        columns = np.clip((x // self.cell_size).astype(np.int64), 0, self.columns - 1)
+        rows = np.clip((y // self.cell_size).astype(np.int64), 0, self.rows - 1)
+        self.cells.update(zip(plants, zip(columns.tolist(), rows.tolist())))
+
+        counts = np.zeros((self.columns + 2, self.rows + 2), dtype=np.int32)
+        np.add.at(counts, (columns + 1, rows + 1), 1)
+        for offset_x in range(3):
+            for offset_y in range(3):
+                self.nearby += counts[offset_x:offset_x + self.columns, offset_y:offset_y + self.rows]
+
+    def discard(self, plant):
+        cell = self.cells.pop(plant, None)
+        if cell is not None:
+            self._change(cell, -1)
+
+    def nearby_count(self, x, y):
+        return int(self.nearby[self.cell_of(x, y)])
+
+    def sparsest(self, positions):
+        # the first one wins a tie
+        return min(positions, key=lambda position: self.nearby_count(*position))
+
+    def _change(self, cell, amount):
+        column, row = cell
+        self.nearby[max(column - 1, 0):column + 2, max(row - 1, 0):row + 2] += amount
+
+class ChunkGrid:
+    # the Area grid as activity chunks: a chunk with no predator around, no busy animal and no timer
+    # due soon sleeps and its entities are only updated every CHUNK_SLEEP_TICKS ticks, with the time they slept
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.routine_counts = np.array([len(AnimalRoutine) if living_type in (LivingType.RABBIT, LivingType.FOX) else len(PlantRoutine)
+                                        for living_type in LivingType])
+        self.resting_states = np.array([STATE_CODES[AnimalStates.WALKING] if living_type in (LivingType.RABBIT, LivingType.FOX)
+                                        else STATE_CODES[LivingBeingStates.NORMAL] for living_type in LivingType])
+
+    def chunk_size(self):
+        areas = self.simulation.areas
+        if not areas:
+            return self.simulation.world_width, self.simulation.world_height
+        return areas[0].width, areas[0].height
+
+    def chunk_coordinates(self):
+        # chunk column and row of every store slot, with the number of columns and rows
+        simulation = self.simulation
+        store = simulation.store
+        size = store.size
+        width, height = self.chunk_size()
+        columns = max(round(simulation.world_width / width), 1)
+        rows = max(round(simulation.world_height / height), 1)
+
+        chunk_x = np.clip((store.x[:size] // width).astype(np.int64), 0, columns - 1)
+        chunk_y = np.clip((store.y[:size] // height).astype(np.int64), 0, rows - 1)
+        return chunk_x, chunk_y, columns, rows
+
+    def awake_slots(self, delta_time):
+        simulation = self.simulation
+        store = simulation.store
+        size = store.size
+        if not simulation.areas:
+            return [True] * size
+
+        width, height = self.chunk_size()
+        chunk_x, chunk_y, columns, rows = self.chunk_coordinates()
+        chunk = chunk_x * rows + chunk_y
+        alive = store.alive[:size]
+        kind = store.kind[:size]
+
+        routines = np.arange(store.timers.shape[1])
+        timers = np.where(routines < self.routine_counts[kind][:, None], store.timers[:size], np.inf)
+        due_soon = timers.min(axis=1) <= simulation.time + delta_time * CHUNK_SLEEP_TICKS
+        busy = (store.state[:size] != self.resting_states[kind]) | (store.target[:size] != NO_TARGET)
+
+        # a busy animal wakes its whole chunk, a timer due soon only wakes its own entity
+        awake = np.zeros(columns * rows, dtype=np.bool_)
+        awake[chunk[alive & busy]] = True
+
+        # predators keep awake every chunk within detection range of them either way, so preys always see them
+        # coming and foxes their prey; the offsets are at most a chunk apart so no chunk in between is missed
+        predators = alive & (kind == LIVING_TYPE_CODES[LivingType.FOX])
+        predator_x, predator_y = store.x[:size][predators], store.y[:size][predators]
+        reach = max(DETECTION_RANGE, PREY_DETECTION_RANGE)
+        for offset_x in np.linspace(-reach, reach, int(2 * reach // width) + 2):
+            for offset_y in np.linspace(-reach, reach, int(2 * reach // height) + 2):
+                near_x = np.clip(((predator_x + offset_x) // width).astype(np.int64), 0, columns - 1)
+                near_y = np.clip(((predator_y + offset_y) // height).astype(np.int64), 0, rows - 1)
+                awake[near_x * rows + near_y] = True
+
+        # sleeping chunks take turns, so their updates spread evenly over the ticks
+        awake |= (np.arange(columns * rows) + simulation.tick) % CHUNK_SLEEP_TICKS == 0
+        return (awake[chunk] | due_soon).tolist()
+
+def free_threaded():
+    # sys._is_gil_enabled only exists from 3.13 on, older and standard builds always hold the GIL
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+class TwoPhaseUpdate:
+    # entity updates run in a sense phase and an act phase. While sensing, entities read a world that does not
+    # change and only write their own fields; every write another entity could see is buffered, moves in per slot
+    # arrays and the rest (hits, deaths, births, scheduler and registry changes) in queues tagged with the writer's
+    # place in the update. Acting commits the moves in bulk through the entity store, then the queued writes in
+    # update order, so neither the update order nor the split into partitions changes the results
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.workers = 1
+        self.executor = None
+        self.local = threading.local()
+        self.seed = 0
+        self.queues = []
+        self.move_x = self.move_y = np.zeros(0)
+
+    def set_workers(self, workers):
+        # with the GIL more threads only add overhead, the single partition then runs inline
+        self.close()
+        self.workers = workers if free_threaded() else 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def partitions_of(self, entities):
+        # stripes of chunks, each keeping the update order of its entities
+        if self.executor is None:
+            return [list(enumerate(entities))]
+
+        chunk_x, _, columns, _ = self.simulation.chunks.chunk_coordinates()
+        stripes = (chunk_x * PARALLEL_PARTITIONS // columns).tolist()
+        partitions = [[] for _ in range(PARALLEL_PARTITIONS)]
+        for order, entity in enumerate(entities):
+            partitions[stripes[entity.slot]].append((order, entity))
+        return partitions
+
+    def sense(self, entities, function):
+        simulation = self.simulation
+        size = simulation.store.size
+        self.move_x = np.zeros(size)
+        self.move_y = np.zeros(size)
+        # every entity draws from its own stream, seeded from the simulation's and its place in the update
+        self.seed = simulation.random.getrandbits(64)
+
+        partitions = self.partitions_of(entities)
+        self.queues = [[] for _ in partitions]
+        simulation.sensing = True
+        try:
+            if self.executor:
+                list(self.executor.map(self.sense_partition, partitions, self.queues, itertools.repeat(function)))
+            else:
+                for partition, writes in zip(partitions, self.queues):
+                    self.sense_partition(partition, writes, function)
+        finally:
+            simulation.sensing = False
+
+    def sense_partition(self, partition, writes, function):
+        local = self.local
+        local.writes = writes
+        for order, entity in partition:
+            local.order = order
+            local.random = None
+            function(entity)
+
+    def act(self):
+        store = self.simulation.store
+        moved = np.flatnonzero((self.move_x != 0) | (self.move_y != 0))
+        store.x[moved] += self.move_x[moved]
+        store.y[moved] += self.move_y[moved]
+        store.push_positions(moved)
+
+        queues, self.queues = self.queues, []
+        for _, write, args in heapq.merge(*queues, key=lambda queued: queued[0]):
+            write(*args)
+
+    def map(self, entities, function):
+        # for work that only writes its own entity, partitioned without the sense buffers
+        if self.executor is None:
+            for entity in entities:
+                function(entity)
+            return
+
+        partitions = self.partitions_of(entities)
+        list(self.executor.map(lambda partition: [function(entity) for _, entity in partition], partitions))
+
+    def defer(self, write, *args):
+        local = self.local
+        local.writes.append((local.order, write, args))
+
+    def move(self, entity, dx, dy):
+        self.move_x[entity.slot] += dx
+        self.move_y[entity.slot] += dy
+
+    def random(self):
+        # seeding costs more than most entities draw, so a stream is only made when first used
+        local = self.local
+        if local.random is None:
+            local.random = random.Random(self.seed + local.order)
+        return local.random
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+class RoutineTimers:
+    # remaining time of each routine, kept as due times in the entity store and the scheduler
+    __slots__ = ("entity",)
+
+    def __init__(self, entity, intervals=None):
+        self.entity = entity
+        # without intervals the due times are already in place, e.g. restored from a checkpoint
+        if intervals is None:
+            return
+
+        entity.due_times = [0] * len(intervals)
+        for routine, interval in enumerate(intervals):
+            self[routine] = interval
+
+    def __getitem__(self, routine):
+        return self.entity.due_times[routine] - self.entity.simulation.time
+
+    def __setitem__(self, routine, interval):
+        simulation = self.entity.simulation
+        simulation.scheduler.schedule(self.entity, routine, simulation.time + interval)
+
+    def __len__(self):
+        return len(self.entity.due_times)
+
+    def __iter__(self):
+        for routine in range(len(self)):
+            yield self[routine]
+
+    def __repr__(self):
+        return repr(list(self))
+
 class HealthBar:
+    __slots__ = ("max_health", "current_health")
+
     def __init__(self, max_health):
         self.max_health = max_health
         self.current_health = max_health
 
-    def draw(self, x, y):
-        if self.current_health != self.max_health:
-            # Calculate health bar width
-            health_width = (self.current_health / self.max_health) * HEALTH_BAR_WIDTH
-            
-            # Background of the health bar
-            center_x = x
-            center_y = y + HEALTH_BAR_OFFSET_Y
-            
-            # Use LRTB version
-            left = center_x - HEALTH_BAR_WIDTH / 2
-            right = center_x + HEALTH_BAR_WIDTH / 2
-            bottom = center_y - HEALTH_BAR_HEIGHT / 2
-            top = center_y + HEALTH_BAR_HEIGHT / 2
-            arcade.draw_lrbt_rectangle_filled(left, right, bottom, top, arcade.color.GRAY)
-
-            # The health itself
-            health_center_x = x - (HEALTH_BAR_WIDTH - health_width) / 2
-            health_left = health_center_x - health_width / 2
-            health_right = health_center_x + health_width / 2
-            arcade.draw_lrbt_rectangle_filled(health_left, health_right, bottom, top, arcade.color.GREEN)
-
-
     def update_health(self, new_health):
         self.current_health = max(0, min(self.max_health, new_health))
 
-class AnimalNeeds:
-    def draw(self, x, y, current_target_object, current_state):
-        if current_target_object != None:
-            balloon_x = x
-            balloon_y = y + BALLOON_OFFSET_Y
-            
-            arcade.draw_rectangle_outline(balloon_x, balloon_y, BALLOON_WIDTH, BALLOON_HEIGHT, arcade.color.BLACK)
+class OverlayLayer:
+    # health bars and need balloons kept as sprites in four SpriteLists, so every overlay is drawn in four calls;
+    # sprites are created when an overlay shows up and only resized or retextured when its value changes
+    def __init__(self):
+        self.bar_backgrounds = arcade.SpriteList()
+        self.bar_fills = arcade.SpriteList()
+        self.balloons = arcade.SpriteList()
+        self.icons = arcade.SpriteList()
+        self.bars = {}
+        self.needs = {}
+
+        image = PIL.Image.new("RGBA", (BALLOON_WIDTH, BALLOON_HEIGHT), (0, 0, 0, 0))
+        PIL.ImageDraw.Draw(image).rectangle((0, 0, BALLOON_WIDTH - 1, BALLOON_HEIGHT - 1), outline=(0, 0, 0, 255))
+        self.balloon_texture = arcade.Texture(image, hash="need-balloon")
+
+    def update(self, entities, now):
+        bars = {}
+        needs = {}
+
+        for entity in entities:
+            health_bar = entity.health_bar
+            last_damage_time = entity.last_damage_time
+            if (health_bar is not None and last_damage_time != None and now - last_damage_time <= 2
+                    and health_bar.current_health != health_bar.max_health):
+                bars[entity] = self.place_bar(entity, self.bars.pop(entity, None))
+
+            target = getattr(entity, "current_target_object", None)
+            if target != None:
+                needs[entity] = self.place_balloon(entity, target, self.needs.pop(entity, None))
+
+        # whatever is left belongs to entities whose overlay went away
+        for background, fill, _ in self.bars.values():
+            background.remove_from_sprite_lists()
+            fill.remove_from_sprite_lists()
+        for balloon, icon in self.needs.values():
+            balloon.remove_from_sprite_lists()
+            icon.remove_from_sprite_lists()
+
+        self.bars = bars
+        self.needs = needs
+
+    def place_bar(self, entity, bar):
+        if bar is None:
+            background = arcade.SpriteSolidColor(HEALTH_BAR_WIDTH, HEALTH_BAR_HEIGHT, color=arcade.color.GRAY)
+            fill = arcade.SpriteSolidColor(HEALTH_BAR_WIDTH, HEALTH_BAR_HEIGHT, color=arcade.color.GREEN)
+            self.bar_backgrounds.append(background)
+            self.bar_fills.append(fill)
+            bar = (background, fill, None)
+
+        background, fill, shown_health = bar
+        health_bar = entity.health_bar
+        health_width = (health_bar.current_health / health_bar.max_health) * HEALTH_BAR_WIDTH
+        if health_bar.current_health != shown_health:
+            fill.visible = health_width > 0
+            fill.width = max(health_width, 0.01)
+
+        center_y = entity.center_y + HEALTH_BAR_OFFSET_Y
+        background.position = (entity.center_x, center_y)
+        fill.position = (entity.center_x - (HEALTH_BAR_WIDTH - health_width) / 2, center_y)
+        return background, fill, health_bar.current_health
+
+    def place_balloon(self, entity, target, need):
+        if need is None:
+            balloon = arcade.Sprite(self.balloon_texture)
+            icon = arcade.Sprite(target.texture)
+            self.balloons.append(balloon)
+            self.icons.append(icon)
+        else:
+            balloon, icon = need
+
+        if icon.texture is not target.texture:
+            icon.texture = target.texture
+        icon.size = (ICON_SIZE, ICON_SIZE)
 
-            self.draw_need_icons(balloon_x, balloon_y, current_target_object)
+        position = (entity.center_x, entity.center_y + BALLOON_OFFSET_Y)
+        balloon.position = position
+        icon.position = position
+        return balloon, icon
 
-    def draw_need_icons(self, balloon_x, balloon_y, current_target_object):
-        texture = current_target_object.texture
-        arcade.draw_texture_rectangle(balloon_x, balloon_y, ICON_SIZE, ICON_SIZE, texture)
+    def draw(self):
+        self.bar_backgrounds.draw()
+        self.bar_fills.draw()
+        self.balloons.draw()
+        self.icons.draw(pixelated=True)
 
 class LivingBeing:
+    # the mixins cannot hold slots next to arcade.Sprite's, so the sprite classes declare them from these names;
+    # mirrored and store fields stay out, their values live in the instance dict or the entity store
+    __slots__ = ()
+    slot_names = ("store", "slot", "due_routines", "sleep_debt", "initial_health", "health_bar", "last_damage_time",
+                  "simulation", "type", "life_expectancy", "reproductive_interval", "reproduce_function", "routines_interval")
+
+    health = MirroredField("health")
+    current_state = StateField()
+
+    # rows of a transition table, and the name of the method each state runs on update
+    transitions = ()
+    state_handler_names = {}
+
+    def __init_subclass__(cls, **kwargs):
+        # the handlers are looked up once per class by state code, so subclass overrides are the ones called
+        super().__init_subclass__(**kwargs)
+        cls.state_handlers = tuple(getattr(cls, cls.state_handler_names[state]) if state in cls.state_handler_names else None
+                                   for state in range(STATE_COUNT))
+
     def __init__(self, health):
+        self.store = None
+        self.slot = None
+        self.due_routines = 0
+        self.sleep_debt = 0
         self.health = health
         self.initial_health = health
-        self.health_bar = HealthBar(self.health)
+        # most entities are never hit, the bar is only made on the first hit
+        self.health_bar = None
         self.last_damage_time = None
 
+    @classmethod
+    def restore(cls, simulation, center_x, center_y):
+        # lightweight constructor for checkpoint loads, nothing is drawn, scheduled or registered;
+        # the caller puts in the saved values and binds the entity to its store slot
+        entity = cls.__new__(cls)
+        init_sprite(entity, entity_texture(cls.texture_path), cls.texture_scale, center_x, center_y)
+        entity.init_living_being(simulation, restored=True)
+        return entity
+
     def take_hit(self, damage, imobilize_on_hits=False):
+        if self.simulation.sensing:
+            return self.simulation.phases.defer(self.take_hit, damage, imobilize_on_hits)
+
         self.health -= damage
+        if self.health_bar is None:
+            self.health_bar = HealthBar(self.initial_health)
         self.health_bar.update_health(self.health)
-        self.last_damage_time = time.time()
+        self.last_damage_time = self.simulation.time
         
         if imobilize_on_hits:
             self.movement_speed = 0
 
         if self.health <= 0.001:
             self.current_state = LivingBeingStates.DEAD
-            self.remove_from_sprite_lists()
+            self.simulation.remove_entity(self)
 
-    def on_draw(self):
-        if self.last_damage_time and (time.time() - self.last_damage_time <= 2):
-            self.health_bar.draw(self.center_x, self.center_y)
+    def apply_state(self, new_state):
+        current_state = self.current_state
+        if new_state != current_state and self.transitions[current_state][new_state]:
+            self.clear_state()
+            self.current_state = new_state
+
+    def update(self, delta_time):
+        # the dead only leave, they were already removed from every lookup when they died
+        if self.current_state == LivingBeingStates.DEAD:
+            return self.simulation.remove_entity(self)
+
+        self.update_routines(delta_time)
+
+        handler = self.state_handlers[self.current_state]
+        if handler is not None:
+            handler(self, delta_time)
 
 class Animal(LivingBeing):
-    def __init__(self, targets, hungry_level, movement_speed, 
+    __slots__ = ()
+    slot_names = LivingBeing.slot_names + ("damage", "current_target_coord", "initial_hungry_level",
+                                           "initital_movement_speed", "movement_speed", "hungry_time_to_fulfill",
+                                           "imobilize_on_hits", "running_speed", "strategy")
+    food_types = ()
+    # experience of each strategy, in the order of strategies
+    strategies = ()
+    transitions = ANIMAL_TRANSITIONS.tolist()
+    state_handler_names = {AnimalStates.WALKING: "on_walking", AnimalStates.PURSUE_FOOD: "on_hungry",
+                           AnimalStates.REPRODUCING: "on_reproducing"}
+
+    due_times = TimersField(AnimalRoutine)
+    experience = RowField("experience", 2)
+    current_target_object = MirroredField("target", encode=EntityStore.slot_of)
+    velocity_x = StoreField("vx")
+    velocity_y = StoreField("vy")
+
+    def __init__(self, hungry_level, movement_speed, 
                  running_speed, health, damage, imobilize_on_hits, 
-                 reproductive_interval, mates, reproduce_function, 
-                 simulation, type, life_expectancy):
+                 reproductive_interval, reproduce_function, 
+                 simulation, type, life_expectancy, restored=False):
         super().__init__(health)
+        self.simulation = simulation
         self.damage = damage
-        self.targets = targets
-        self.mates = mates
         self.current_target_object = None
         self.current_target_coord = None
         self.reproductive_interval = reproductive_interval
-        self.routines_interval = [hungry_level + random.randrange(0, 10), IDDLE_TIME + random.randrange(0, 10), reproductive_interval + random.randrange(0, 10), life_expectancy + random.randrange(0, 10)]
+        # a restored entity gets its due times from the checkpoint, so nothing is drawn or scheduled
+        intervals = None if restored else [hungry_level + simulation.random.randrange(0, 10), IDDLE_TIME + simulation.random.randrange(0, 10), reproductive_interval + simulation.random.randrange(0, 10), life_expectancy + simulation.random.randrange(0, 10)]
+        self.routines_interval = RoutineTimers(self, intervals)
         self.initial_hungry_level = hungry_level
         self.initital_movement_speed = movement_speed
         self.movement_speed = movement_speed
@@ -169,69 +1003,63 @@ class Animal(LivingBeing):
         self.imobilize_on_hits = imobilize_on_hits
         self.running_speed = running_speed
         self.current_state = AnimalStates.WALKING
-        self.animal_needs = AnimalNeeds()
         self.reproduce_function = reproduce_function
-        self.simulation = simulation
         self.type = type
         self.life_expectancy = life_expectancy
         self.strategy = None
-        self.experience = {}
+        # the store fields of a restored entity are already in the store row it is bound to
+        if not restored:
+            self.experience = (0, 0)
+            self.velocity_x = 0
+            self.velocity_y = 0
+
+    def best_strategy(self):
+        # the first one wins a tie
+        experience = self.experience
+        return self.strategies[1] if experience[1] > experience[0] else self.strategies[0]
 
     def force_hungry(self):
         self.routines_interval[AnimalRoutine.HUNGRY.value] = -1
 
-    def on_hungry(self, delta_time):
-        nearest_target_dist = float("inf")
+    def has_target_alive(self):
+        return self.simulation.population.any_alive(*self.food_types)
 
-        for target in self.targets:
-            current_dist = get_square_distance(self.center_x, self.center_y, target.center_x, target.center_y)
-            if nearest_target_dist * nearest_target_dist > current_dist and target.current_state != LivingBeingStates.DEAD or self.current_target_object == None or self.current_target_object.current_state == LivingBeingStates.DEAD:
-                nearest_target_dist = math.sqrt(current_dist)
-                self.current_target_object = target
+    def on_hungry(self, delta_time):
+        self.current_target_object = self.find_nearest_target()
+        if self.current_target_object == None:
+            return
 
+        target = self.current_target_object
+        nearest_target_dist = math.sqrt(get_square_distance(self.center_x, self.center_y, target.center_x, target.center_y))
         if nearest_target_dist < INTERACT_RANGE:
-            self.eat(delta_time, self.current_target_object)
+            self.eat(delta_time, target)
         
-        if self.current_target_object != None and self.current_target_object.current_state == LivingBeingStates.DEAD:
+        if target.current_state == LivingBeingStates.DEAD:
             self.clear_state()
 
-    def on_reproducing(self, delta_time):
-        nearest_target_dist = float("inf")
-
-        if not self.current_target_object or self.current_target_object.type != self.type:
-            self.current_target_object = None
-            for target in self.mates:
-                current_dist = get_square_distance(self.center_x, self.center_y, target.center_x, target.center_y)
-                if nearest_target_dist * nearest_target_dist > current_dist and target.current_state != AnimalStates.DEAD and target.current_state != AnimalStates.REPRODUCING:
-                    nearest_target_dist =  math.sqrt(current_dist)
-                    self.current_target_object = target
-                    target.current_state = AnimalStates.REPRODUCING
-                    target.current_target_object = self
-        
-        if self.current_target_object:
-            if self.current_target_object.current_state == AnimalStates.DEAD:
-                self.routines_interval[AnimalRoutine.REPRODUCTIVE_INTERVAL.value] = self.reproductive_interval
-                self.clear_state()
+    def has_mate(self):
+        return self.current_target_object != None and self.current_target_object.type == self.type
 
-            target = self.current_target_object
-            if target:
-                distance = get_square_distance(self.center_x, self.center_y, target.center_x, target.center_y)
-                if distance < INTERACT_RANGE * INTERACT_RANGE:
-                    self.reproduce(self.current_target_object)
+    def on_reproducing(self, delta_time):
+        # partners are paired and reproduce in Simulation.match_mates, here we only give up on a dead one
+        if self.has_mate() and self.current_target_object.current_state in DEAD_STATES:
+            self.routines_interval[AnimalRoutine.REPRODUCTIVE_INTERVAL.value] = self.reproductive_interval
+            self.clear_state()
 
     def set_walk_around_target(self):
+        entity_random = self.simulation.entity_random()
         area = None
         if hasattr(self, 'strategy'):
             if self.strategy == 'forage_open' and self.simulation.open_areas:
-                area = random.choice(self.simulation.open_areas)
+                area = entity_random.choice(self.simulation.open_areas)
             elif self.strategy == 'forage_cover' and self.simulation.covered_areas:
-                area = random.choice(self.simulation.covered_areas)
+                area = entity_random.choice(self.simulation.covered_areas)
 
         if not area:
-            area = random.choice(self.simulation.areas)
+            area = entity_random.choice(self.simulation.areas)
 
-        target_x = random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2)
-        target_y = random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2)
+        target_x = entity_random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2)
+        target_y = entity_random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2)
         self.current_target_coord = [target_x, target_y]
         
     def eat(self, delta_time, target):
@@ -271,39 +1099,39 @@ class Animal(LivingBeing):
         if distance > min_distance * min_distance:
             movement_speed = self.running_speed if running else self.movement_speed
 
-            self.center_x += normalized_x * movement_speed * delta_time
-            self.center_y += normalized_y * movement_speed * delta_time
+            # moves go through the sense phase buffers, a direct position write would skip them
+            if not self.simulation.sensing:
+                raise RuntimeError("Animal.walk is only called from the sense phase of an entity update")
+            self.simulation.phases.move(self, normalized_x * movement_speed * delta_time,
+                                        normalized_y * movement_speed * delta_time)
 
-    def update(self, delta_time):
+    def update_strategy(self):
+        pass
+
+    def calculate_payoff(self, delta_time):
+        pass
+
+    def update_routines(self, delta_time):
+        self.update_strategy()
+        self.calculate_payoff(delta_time)
         self.handle_current_state(delta_time)
         # print(f"location x: {self.center_x} y: {self.center_x}, state: {self.current_state}, routines: {self.routines_interval}, type: {self.type}")
 
-        for index, interval in enumerate(self.routines_interval):
-            self.routines_interval[index] = interval - delta_time 
-        
+        # routine timers are due times checked by the simulation's RoutineScheduler, not decremented here
         self.life_expectancy = self.routines_interval[AnimalRoutine.LIFE_EXPECTANCY.value]
         
         if self.current_target_object:
             self.walk(delta_time, [self.current_target_object.center_x, self.current_target_object.center_y], True)
 
-        # food call
-        if self.current_state == AnimalStates.PURSUE_FOOD:
-            return self.on_hungry(delta_time)
+    def on_walking(self, delta_time):
+        iddle_location_expired = self.due_routines & IDDLE_TIME_DUE
+        has_target_location = self.current_target_coord is not None
 
-        # reproducing call
-        if self.current_state == AnimalStates.REPRODUCING:
-            return self.on_reproducing(delta_time)
+        if iddle_location_expired or not has_target_location:
+            self.set_walk_around_target()
+            self.routines_interval[AnimalRoutine.IDDLE_TIME.value] = IDDLE_TIME
 
-        # walking call
-        if self.current_state == AnimalStates.WALKING:
-            iddle_location_expired = self.routines_interval[AnimalRoutine.IDDLE_TIME.value] < 0 
-            has_target_location = self.current_target_coord != None
-
-            if iddle_location_expired or not has_target_location:
-                self.set_walk_around_target()
-                self.routines_interval[AnimalRoutine.IDDLE_TIME.value] = IDDLE_TIME
-
-            self.walk(delta_time, self.current_target_coord, False)
+        self.walk(delta_time, self.current_target_coord, False)
         
     def clear_state(self):
         self.current_state = AnimalStates.WALKING
@@ -312,62 +1140,48 @@ class Animal(LivingBeing):
         self.movement_speed = self.initital_movement_speed
 
     def handle_current_state(self, delta_time):
-        if self.current_state == LivingBeingStates.DEAD:
-            self.remove_from_sprite_lists()
-
-        if self.current_state == None:
-            self.current_state = AnimalStates.WALKING
-
-        any_target_alive = len(list(filter(lambda target: target.current_state != AnimalStates.DEAD, self.targets))) > 0
-        is_char_hungry = self.routines_interval[AnimalRoutine.HUNGRY.value] < 0
+        is_char_hungry = self.due_routines & HUNGRY_DUE
         if is_char_hungry:
-            if any_target_alive:
+            if self.has_target_alive():
                 self.apply_state(AnimalStates.PURSUE_FOOD)
             else:
                 self.take_hit(delta_time, False)
 
-        if self.routines_interval[AnimalRoutine.REPRODUCTIVE_INTERVAL.value] < 0:
+        if self.due_routines & ANIMAL_REPRODUCTIVE_DUE:
             self.apply_state(AnimalStates.REPRODUCING)
 
-        if self.current_state == AnimalStates.PURSUE_FOOD and not any_target_alive:
+        if self.current_state == AnimalStates.PURSUE_FOOD and not self.has_target_alive():
             self.clear_state()
         
-        is_target_life_expectancy_reached = self.routines_interval[AnimalRoutine.LIFE_EXPECTANCY.value] < 0
+        is_target_life_expectancy_reached = self.due_routines & ANIMAL_LIFE_EXPECTANCY_DUE
         if is_target_life_expectancy_reached:
             self.current_state = AnimalStates.DEAD
             self.take_hit(self.health, False)
 
-    def apply_state(self, new_state):
-        if new_state != self.current_state:
-            if self.current_state == AnimalStates.PURSUE_FOOD and new_state != AnimalStates.DEAD:
-                return
-
-            self.clear_state()
-            self.current_state = new_state
+class Plant(LivingBeing):
+    __slots__ = ()
+    slot_names = LivingBeing.slot_names
+    transitions = PLANT_TRANSITIONS.tolist()
+    state_handler_names = {LivingBeingStates.REPRODUCING: "on_reproducing"}
 
-    def on_draw(self): 
-        LivingBeing.on_draw(self)
-        self.animal_needs.draw(self.center_x, self.center_y, self.current_target_object, self.current_state)
+    due_times = TimersField(PlantRoutine)
 
-class Plant(LivingBeing):
     def __init__(self, health, reproductive_interval, reproduce_function, 
-                 simulation, life_expectancy, type):
+                 simulation, life_expectancy, type, restored=False):
         super().__init__(health)
         self.reproductive_interval = reproductive_interval
         self.reproduce_function = reproduce_function
         self.simulation = simulation
         self.life_expectancy = life_expectancy
-        self.routines_interval = [reproductive_interval + random.randrange(0, 10), life_expectancy + random.randrange(0, 10)]
+        intervals = None if restored else [reproductive_interval + simulation.random.randrange(0, 10), life_expectancy + simulation.random.randrange(0, 10)]
+        self.routines_interval = RoutineTimers(self, intervals)
         self.current_state = LivingBeingStates.NORMAL
         self.type = type
 
-    def on_draw(self): 
-        LivingBeing.on_draw(self)
-    
     def clear_state(self):
         self.current_state = LivingBeingStates.NORMAL
 
-    def on_reproducing(self):
+    def on_reproducing(self, delta_time):
         self.reproduce()
     
     def reproduce(self):
@@ -375,34 +1189,20 @@ class Plant(LivingBeing):
 
         self.clear_state()
 
+        # births draw positions from the simulation stream, so they wait for the act phase
+        if self.simulation.sensing:
+            return self.simulation.phases.defer(self.reproduce_function)
         self.reproduce_function()
     
-    def apply_state(self, new_state):
-        if new_state != self.current_state:
-            self.current_state = new_state
-
-    def handle_current_state(self):
-        if self.current_state == LivingBeingStates.DEAD:
-            self.remove_from_sprite_lists()
-
-        if self.current_state == None:
-            self.current_state = LivingBeingStates.NORMAL
-
-        if self.routines_interval[PlantRoutine.REPRODUCTIVE_INTERVAL.value] < 0:
-            self.apply_state(LivingBeingStates.REPRODUCING)
-        
-        is_target_life_expectancy_reached = self.routines_interval[PlantRoutine.LIFE_EXPECTANCY.value] < 0
+    def update_routines(self, delta_time):
+        # the death is only written in the act phase, so a plant dying on this tick must not start reproducing
+        is_target_life_expectancy_reached = self.due_routines & PLANT_LIFE_EXPECTANCY_DUE
         if is_target_life_expectancy_reached:
             self.current_state = LivingBeingStates.DEAD
-    
-    def update(self, delta_time):
-        self.handle_current_state()
-
-        for index, interval in enumerate(self.routines_interval):
-            self.routines_interval[index] = interval - delta_time 
+            return
 
-        if self.current_state == LivingBeingStates.REPRODUCING:
-            return self.on_reproducing()
+        if self.due_routines & PLANT_REPRODUCTIVE_DUE:
+            self.apply_state(LivingBeingStates.REPRODUCING)
 
 class PreySocialController():
     def __init__(self, simulation):
@@ -416,15 +1216,30 @@ class PreySocialController():
         self.alignment_weight = 0.5
         self.cohesion_weight = 0.1
 
+        # flock every prey at once from the entity store arrays instead of one prey at a time
+        self.batched = True
+
     def update(self, deltatime):
+        if self.batched:
+            self.flock_all(deltatime)
+
+        # a sleeping prey has no predator in reach, so there is nothing to avoid
+        is_awake = self.simulation.is_awake
+        phases = self.simulation.phases
+        if self.batched and phases.executor:
+            # avoiding only reads predators and writes the prey's own velocity, so it can run on the partitions
+            awake_preys = [prey for prey in self.preys if is_awake(prey)]
+            phases.map(awake_preys, lambda prey: self.avoid_predators(prey, deltatime))
+            return
+
         for prey in self.preys:
-            self.flock(prey, deltatime)
-            self.avoid_predators(prey, deltatime)
+            if not self.batched:
+                self.flock(prey, deltatime)
+            if is_awake(prey):
+                self.avoid_predators(prey, deltatime)
 
     def flock(self, current_rabbit, deltatime):
-        dir_separation = self.separation(current_rabbit)
-        dir_alignment = self.alignment(current_rabbit)
-        dir_cohesion = self.cohesion(current_rabbit)
+        dir_separation, dir_alignment, dir_cohesion = self.steering(current_rabbit)
 
         dir = [
         (dir_separation[0] * self.separation_weight +
@@ -444,91 +1259,133 @@ class PreySocialController():
         if speed > self.max_speed:
             current_rabbit.velocity_x = (current_rabbit.velocity_x / speed) * self.max_speed
             current_rabbit.velocity_y = (current_rabbit.velocity_y / speed) * self.max_speed
-    
-    def separation(self, current_rabbit):
-        dir = [0, 0] # direcao do movimento
+
+    def steering(self, current_rabbit):
+        # separation, alignment and cohesion computed from a single pass over the neighbours
+        separation = [0, 0] # direcao do movimento
+        separation_total = 0 # total de coelhos com influencia (dentro do raio de separacao)
+        avg_velocity = [0, 0]
+        center_of_mass = [0, 0]
         total = 0 # total de coelhos com influencia (dentro do raio de percepcao)
-        nearby_rabbits = self.simulation.spatial_grid.get_nearby_sprites(current_rabbit.center_x, current_rabbit.center_y)
+
+        x = current_rabbit.center_x
+        y = current_rabbit.center_y
+        separation_radius_square = self.separation_radius * self.separation_radius
+
+        nearby_rabbits = self.simulation.spatial_grid.query_radius(x, y, self.perception_radius)
         for rabbit in nearby_rabbits:
-            if rabbit is not current_rabbit:
-                distance_square = get_square_distance(current_rabbit.center_x, current_rabbit.center_y,
-                                               rabbit.center_x, rabbit.center_y)
-                if distance_square < (self.separation_radius * self.separation_radius): # ha influencia da separacao apenas quando a distancia < raio de separacao
-                    diff_x = current_rabbit.center_x - rabbit.center_x
-                    diff_y = current_rabbit.center_y - rabbit.center_y
-                    if distance_square > 0:
-                        distance = math.hypot(current_rabbit.center_x - rabbit.center_x, current_rabbit.center_y - rabbit.center_y)
-                        diff_x /= distance
-                        diff_y /= distance
-                    dir[0] += diff_x
-                    dir[1] += diff_y
-                    total += 1
-        if total > 0:
-            dir[0] /= total
-            dir[1] /= total
-        return dir
-    
+            if rabbit is current_rabbit:
+                continue
+
+            rabbit_x = rabbit.center_x
+            rabbit_y = rabbit.center_y
+            diff_x = x - rabbit_x
+            diff_y = y - rabbit_y
+            distance_square = diff_x * diff_x + diff_y * diff_y
+
+            if distance_square < separation_radius_square: # ha influencia da separacao apenas quando a distancia < raio de separacao
+                if distance_square > 0:
+                    distance = math.sqrt(distance_square)
+                    diff_x /= distance
+                    diff_y /= distance
+                separation[0] += diff_x
+                separation[1] += diff_y
+                separation_total += 1
+
+            avg_velocity[0] += rabbit.velocity_x
+            avg_velocity[1] += rabbit.velocity_y
+            center_of_mass[0] += rabbit_x
+            center_of_mass[1] += rabbit_y
+            total += 1
+
+        if separation_total > 0:
+            separation[0] /= separation_total
+            separation[1] /= separation_total
+
+        if total == 0:
+            return separation, [0, 0], [0, 0]
+
+        alignment = [avg_velocity[0] / total - current_rabbit.velocity_x,
+                     avg_velocity[1] / total - current_rabbit.velocity_y]
+        cohesion = [center_of_mass[0] / total - x,
+                    center_of_mass[1] / total - y]
+        return separation, alignment, cohesion
+
+    def separation(self, current_rabbit):
+        return self.steering(current_rabbit)[0]
+
     def alignment(self, current_rabbit):
-        avg_velocity = [0, 0]
-        total = 0
-        nearby_rabbits = self.simulation.spatial_grid.get_nearby_sprites(current_rabbit.center_x, current_rabbit.center_y)
-        for rabbit in nearby_rabbits:
-            if rabbit is not current_rabbit:
-                distance = get_square_distance(current_rabbit.center_x, current_rabbit.center_y,
-                                               rabbit.center_x, rabbit.center_y)
-                if distance < self.perception_radius * self.perception_radius:
-                    avg_velocity[0] += rabbit.velocity_x
-                    avg_velocity[1] += rabbit.velocity_y
-                    total += 1
-        if total > 0:
-            avg_velocity[0] /= total
-            avg_velocity[1] /= total
+        return self.steering(current_rabbit)[1]
 
-            dir = [avg_velocity[0] - current_rabbit.velocity_x,
-                        avg_velocity[1] - current_rabbit.velocity_y]
-            return dir
-        else:
-            return [0, 0]
-        
     def cohesion(self, current_rabbit):
-        center_of_mass = [0, 0]
-        total = 0
-        nearby_rabbits = self.simulation.spatial_grid.get_nearby_sprites(current_rabbit.center_x, current_rabbit.center_y)
-        for rabbit in nearby_rabbits:
-            if rabbit is not current_rabbit:
-                distance = get_square_distance(current_rabbit.center_x, current_rabbit.center_y,
-                                               rabbit.center_x, rabbit.center_y)
-                if distance < self.perception_radius * self.perception_radius:
-                    center_of_mass[0] += rabbit.center_x
-                    center_of_mass[1] += rabbit.center_y
-                    total += 1
-        if total > 0:
-            center_of_mass[0] /= total
-            center_of_mass[1] /= total
+        return self.steering(current_rabbit)[2]
 
-            direction = [center_of_mass[0] - current_rabbit.center_x,
-                        center_of_mass[1] - current_rabbit.center_y]
-            return direction
-        else:
-            return [0, 0]
+    def flock_all(self, deltatime):
+        store = self.simulation.store
+        size = store.size
+        slots = np.flatnonzero(store.alive[:size] & (store.kind[:size] == LIVING_TYPE_CODES[LivingType.RABBIT]))
+        if len(slots) == 0:
+            return
+
+        x = store.x[slots]
+        y = store.y[slots]
+        vx = store.vx[slots]
+        vy = store.vy[slots]
+        count = len(slots)
+
+        i, j = find_neighbour_pairs(x, y, self.perception_radius)
+        diff_x = x[i] - x[j]
+        diff_y = y[i] - y[j]
+        distance_square = diff_x * diff_x + diff_y * diff_y
+
+        near = distance_square < self.perception_radius * self.perception_radius
+        total = np.bincount(i[near], minlength=count)
+        has_neighbours = total > 0
+        divisor = np.maximum(total, 1)
+
+        alignment_x = np.where(has_neighbours, np.bincount(i[near], vx[j[near]], count) / divisor - vx, 0)
+        alignment_y = np.where(has_neighbours, np.bincount(i[near], vy[j[near]], count) / divisor - vy, 0)
+        cohesion_x = np.where(has_neighbours, np.bincount(i[near], x[j[near]], count) / divisor - x, 0)
+        cohesion_y = np.where(has_neighbours, np.bincount(i[near], y[j[near]], count) / divisor - y, 0)
+
+        close = distance_square < self.separation_radius * self.separation_radius
+        distance = np.sqrt(distance_square[close])
+        distance[distance == 0] = 1
+        separation_total = np.maximum(np.bincount(i[close], minlength=count), 1)
+        separation_x = np.bincount(i[close], diff_x[close] / distance, count) / separation_total
+        separation_y = np.bincount(i[close], diff_y[close] / distance, count) / separation_total
+
+        dir_x = (separation_x * self.separation_weight +
+                 alignment_x * self.alignment_weight +
+                 cohesion_x * self.cohesion_weight)
+        dir_y = (separation_y * self.separation_weight +
+                 alignment_y * self.alignment_weight +
+                 cohesion_y * self.cohesion_weight)
+
+        limit_vectors(dir_x, dir_y, max_value=0.5)
+        vx += dir_x
+        vy += dir_y
+        limit_vectors(vx, vy, max_value=self.max_speed)
+
+        store.vx[slots] = vx
+        store.vy[slots] = vy
 
     def avoid_predators(self, current_rabbit, deltatime):
-        predators = self.simulation.predators
+        predators = self.simulation.predator_spatial_grid.query_radius(current_rabbit.center_x, current_rabbit.center_y,
+                                                                       self.perception_radius)
         dir = [0, 0]
         total = 0
         for predator in predators:
-            square_distance = get_square_distance(current_rabbit.center_x, current_rabbit.center_y,
-                                            predator.center_x, predator.center_y)
-            if square_distance < self.perception_radius * self.perception_radius:
-                diff_x = current_rabbit.center_x - predator.center_x
-                diff_y = current_rabbit.center_y - predator.center_y
-                distance = math.hypot(current_rabbit.center_x - predator.center_x, current_rabbit.center_y - predator.center_y)
-                if square_distance > 0:
-                    diff_x /= distance
-                    diff_y /= distance
-                dir[0] += diff_x
-                dir[1] += diff_y
-                total += 1
+            diff_x = current_rabbit.center_x - predator.center_x
+            diff_y = current_rabbit.center_y - predator.center_y
+            square_distance = diff_x * diff_x + diff_y * diff_y
+            if square_distance > 0:
+                distance = math.sqrt(square_distance)
+                diff_x /= distance
+                diff_y /= distance
+            dir[0] += diff_x
+            dir[1] += diff_y
+            total += 1
         if total > 0:
             dir[0] /= total
             dir[1] /= total
@@ -537,53 +1394,50 @@ class PreySocialController():
 
 
 class PreySprite(arcade.Sprite, Animal):
-    def __init__(self, posX, posY, bushes, grass_patches, simulation):
-        super().__init__("images/entities/base-rabbit.png", 2)
-        targets = arcade.SpriteList()
-        targets.extend(bushes)
-        targets.extend(grass_patches)
-        Animal.__init__(self, targets, RABBIT_HUNGRY_INTERVAL, RABBIT_MOVEMENT_SPEED, 
+    __slots__ = Animal.slot_names + ("highlight",)
+    food_types = PLANT_TYPES
+    strategies = ('forage_open', 'forage_cover')
+
+    texture_path = "images/entities/base-rabbit.png"
+    texture_scale = 2
+
+    def __init__(self, posX, posY, simulation):
+        super().__init__(entity_texture(self.texture_path), self.texture_scale, posX, posY)
+        self.init_living_being(simulation)
+
+    def init_living_being(self, simulation, restored=False):
+        Animal.__init__(self, RABBIT_HUNGRY_INTERVAL, RABBIT_MOVEMENT_SPEED, 
                         RABBIT_RUNNING_SPEED, RABBIT_HEALTH, 1, False, RABBIT_REPRODUCTIVE_INTERVAL, 
-                        simulation.preys, simulation.add_prey, simulation, LivingType.RABBIT, RABBIT_LIFE_EXPECTANCY)
-        self.center_x = posX
-        self.center_y = posY
-        self.targets = targets
-        self.simulation = simulation
-        self.experience = {'forage_open': 0, 'forage_cover': 0}
+                        simulation.add_prey, simulation, LivingType.RABBIT, RABBIT_LIFE_EXPECTANCY, restored)
         self.strategy = 'forage_open'
 
-        self.velocity_x = 0
-        self.velocity_y = 0
+        if not restored:
+            self.velocity_x = 0
+            self.velocity_y = 0
 
         self.highlight = False
         self.color = (255, 255, 255)
 
-    def on_draw(self, highlight=False):
-        Animal.on_draw(self)
-        if highlight:
-            self.draw_perception_circle()
-    
+    def find_nearest_target(self):
+        return self.simulation.nearest_food(self.center_x, self.center_y)
+
     def draw_perception_circle(self):
-        if self.simulation.is_debugging:
-            arcade.draw_circle_outline(
-                self.center_x, self.center_y,
-                RABBIT_PERCEPTION_RADIUS,
-                color=arcade.color.RED, 
-                border_width=2 
-            )
+        arcade.draw_circle_outline(
+            self.center_x, self.center_y,
+            RABBIT_PERCEPTION_RADIUS,
+            color=arcade.color.RED, 
+            border_width=2 
+        )
     
     def detect_predators(self):
-        predators_nearby = [pred for pred in self.simulation.predators
-                            if get_square_distance(self.center_x, self.center_y,
-                                                   pred.center_x, pred.center_y) < DETECTION_RANGE * DETECTION_RANGE]
-        return predators_nearby
+        return list(self.simulation.predator_spatial_grid.query_radius(self.center_x, self.center_y, DETECTION_RANGE))
     
     def update_strategy(self):
         predators_nearby = self.detect_predators()
         if predators_nearby:
             self.strategy = 'forage_cover'
         else:
-            self.strategy = max(self.experience, key=self.experience.get)
+            self.strategy = self.best_strategy()
 
     def calculate_payoff(self, delta_time):
         if self.strategy == 'forage_open':
@@ -594,22 +1448,16 @@ class PreySprite(arcade.Sprite, Animal):
             predation_risk = 0.5
 
         payoff = food_amount - predation_risk
-        self.experience[self.strategy] += payoff * delta_time
+        self.experience[self.strategies.index(self.strategy)] += payoff * delta_time
     
     def update(self, delta_time):
-        self.update_strategy()
-        self.calculate_payoff(delta_time)
+        # velocity integration and screen edge bouncing run vectorized in Simulation.step
+        # self.center_x = max(0, min(self.center_x, SCREEN_WIDTH))
+        # self.center_y = max(0, min(self.center_y, SCREEN_HEIGHT))
 
-        if self.current_target_object is None:
-            self.center_x += self.velocity_x * delta_time
-            self.center_y += self.velocity_y * delta_time
+        Animal.update(self, delta_time)
 
-        if self.center_x < 0 or self.center_x > SCREEN_WIDTH:
-            self.velocity_x *= -1
-        
-        if self.center_y < 0 or self.center_y > SCREEN_HEIGHT:
-            self.velocity_y *= -1
-        
+    def update_tint(self):
         current_life_expectancy_percentage = self.life_expectancy / RABBIT_LIFE_EXPECTANCY
 
         if current_life_expectancy_percentage < .4:
@@ -619,27 +1467,28 @@ class PreySprite(arcade.Sprite, Animal):
 
         self.color = (current_color, current_color, current_color)
 
-        # self.center_x = max(0, min(self.center_x, SCREEN_WIDTH))
-        # self.center_y = max(0, min(self.center_y, SCREEN_HEIGHT))
+class PredatorSprite(arcade.Sprite, Animal):
+    __slots__ = Animal.slot_names + ("walls", "path_list")
+    food_types = (LivingType.RABBIT,)
+    strategies = ('active_hunt', 'ambush')
 
-        Animal.update(self, delta_time)
+    texture_path = "images/entities/base-fox.png"
+    texture_scale = 2
 
-class PredatorSprite(arcade.Sprite, Animal):
     def __init__(self, posX, posY, simulation):
-        super().__init__("images/entities/base-fox.png", 2)
-        Animal.__init__(self, simulation.preys, FOX_HUNGRY_INTERVAL, FOX_MOVEMENT_SPEED,
+        super().__init__(entity_texture(self.texture_path), self.texture_scale, posX, posY)
+        self.init_living_being(simulation)
+
+    def init_living_being(self, simulation, restored=False):
+        Animal.__init__(self, FOX_HUNGRY_INTERVAL, FOX_MOVEMENT_SPEED,
                          FOX_RUNNING_SPEED, FOX_HEALTH, 1, True, FOX_REPRODUCTIVE_INTERVAL,
-                           simulation.predators, simulation.add_predator, simulation, LivingType.FOX, FOX_LIFE_EXPECTANCY)
-        self.center_x = posX
-        self.center_y = posY
+                           simulation.add_predator, simulation, LivingType.FOX, FOX_LIFE_EXPECTANCY, restored)
         self.walls = None
         self.path_list = None
         self.strategy = 'active_hunt'
-        self.experience = {'active_hunt': 0, 'ambush': 0}
     
     def on_hungry(self, delta_time):
-        self.update_strategy()
-
+        # the strategy was already refreshed this tick by update()
         if self.strategy == 'active_hunt':
             self.active_hunt(delta_time)
         elif self.strategy == 'ambush':
@@ -681,26 +1530,24 @@ class PredatorSprite(arcade.Sprite, Animal):
     
     def set_ambush_position(self):
         if self.simulation.open_areas:
-            area = random.choice(self.simulation.open_areas)
+            entity_random = self.simulation.entity_random()
+            area = entity_random.choice(self.simulation.open_areas)
             self.current_target_coord = [
-                random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2),
-                random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2)
+                entity_random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2),
+                entity_random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2)
             ]
         else:
             self.current_target_coord = [self.center_x, self.center_y]
 
     def detect_prey(self):
-        preys_nearby = [prey for prey in self.simulation.preys
-                        if get_square_distance(self.center_x, self.center_y,
-                                               prey.center_x, prey.center_y) < DETECTION_RANGE * DETECTION_RANGE + 25]
-        return preys_nearby
+        return list(self.simulation.spatial_grid.query_radius(self.center_x, self.center_y, PREY_DETECTION_RANGE))
 
     def update_strategy(self):
         preys_nearby = self.detect_prey()
         if preys_nearby:
             self.strategy = 'active_hunt'
         else:
-            self.strategy = max(self.experience, key=self.experience.get)
+            self.strategy = self.best_strategy()
         
     def calculate_payoff(self, deltatime):
         if self.strategy == 'active_hunt':
@@ -711,12 +1558,12 @@ class PredatorSprite(arcade.Sprite, Animal):
             success_rate = 0.5
 
         payoff = success_rate * 2 - energy_spent
-        self.experience[self.strategy] += payoff * deltatime
+        self.experience[self.strategies.index(self.strategy)] += payoff * deltatime
 
     def update(self, delta_time):
-        self.update_strategy()
-        self.calculate_payoff(delta_time)
+        Animal.update(self, delta_time)
 
+    def update_tint(self):
         current_life_expectancy_percentage = self.life_expectancy / FOX_LIFE_EXPECTANCY
 
         if current_life_expectancy_percentage < .4:
@@ -726,37 +1573,36 @@ class PredatorSprite(arcade.Sprite, Animal):
 
         self.color = (current_color, current_color, current_color)
 
-        Animal.update(self, delta_time)
-    
-    def on_draw(self):
-        Animal.on_draw(self)
-
 class BushSprite(arcade.Sprite, Plant):
+    __slots__ = Plant.slot_names
+    texture_path = "images/entities/base-bush.png"
+    texture_scale = 2
+
     def __init__(self, posX, posY, simulation):
-        super().__init__("images/entities/base-bush.png", scale=2)
-        Plant.__init__(self, PLANT_HEALTH, PLANT_REPRODUCTIVE_INTERVAL, simulation.add_bush, simulation, PLANT_LIFE_EXPECTANCY, LivingType.PLANT)
-        self.center_x = posX
-        self.center_y = posY
+        super().__init__(entity_texture(self.texture_path), self.texture_scale, posX, posY)
+        self.init_living_being(simulation)
+
+    def init_living_being(self, simulation, restored=False):
+        Plant.__init__(self, PLANT_HEALTH, PLANT_REPRODUCTIVE_INTERVAL, simulation.add_bush, simulation, PLANT_LIFE_EXPECTANCY, LivingType.PLANT, restored)
 
     def update(self, delta_time):
         Plant.update(self, delta_time)
     
-    def on_draw(self):
-        Plant.on_draw(self)
-    
 class GrassPatchSprite(arcade.Sprite, Plant):
+    __slots__ = Plant.slot_names
+    texture_path = "images/entities/base-grass-half-2.png"
+    texture_scale = 1
+
     def __init__(self, posX, posY, simulation):
-        super().__init__("images/entities/base-grass-half-2.png", scale=1)
-        Plant.__init__(self, PLANT_HEALTH, PLANT_REPRODUCTIVE_INTERVAL, simulation.add_grass_patch, simulation, PLANT_LIFE_EXPECTANCY, LivingType.GRASS)
-        self.center_x = posX
-        self.center_y = posY
+        super().__init__(entity_texture(self.texture_path), self.texture_scale, posX, posY)
+        self.init_living_being(simulation)
+
+    def init_living_being(self, simulation, restored=False):
+        Plant.__init__(self, PLANT_HEALTH, PLANT_REPRODUCTIVE_INTERVAL, simulation.add_grass_patch, simulation, PLANT_LIFE_EXPECTANCY, LivingType.GRASS, restored)
     
     def update(self, delta_time):
         Plant.update(self, delta_time)
     
-    def on_draw(self):
-        Plant.on_draw(self)
-    
 class CardSprite(arcade.Sprite): 
     def __init__(self, card_type_obj, simulation):
         card_scale = 1.5
@@ -829,13 +1675,17 @@ class CardSprite(arcade.Sprite):
         
         return " ".join(elements)
 
-    def draw_overlays(self):
-        # This method draws the text overlays. The sprite itself is drawn by the SpriteList.
-        arcade.draw_text(f"{self.title}", self.center_x - 64 + 16, self.center_y + 40, arcade.color.BLACK, 15, anchor_x="center", width=128 - 32)
-        arcade.draw_text(f"{self.description}", self.center_x - 64 + 16, self.center_y - 20, arcade.color.BLACK, 10, anchor_x="center", width=128 - 32)
-        arcade.draw_text(f"{self.cost_to_text()}", self.center_x - 64 + 16, self.center_y - 95, arcade.color.BLACK, 10, anchor_x="center", width=128 - 32)
+    def create_texts(self, batch):
+        # This method lays out the text overlays once, they are drawn with the batch. The sprite itself is drawn by the SpriteList.
+        return [
+            arcade.Text(f"{self.title}", self.center_x - 64 + 16, self.center_y + 40, arcade.color.BLACK, 15, anchor_x="center", width=128 - 32, batch=batch),
+            arcade.Text(f"{self.description}", self.center_x - 64 + 16, self.center_y - 20, arcade.color.BLACK, 10, anchor_x="center", width=128 - 32, batch=batch),
+            arcade.Text(f"{self.cost_to_text()}", self.center_x - 64 + 16, self.center_y - 95, arcade.color.BLACK, 10, anchor_x="center", width=128 - 32, batch=batch),
+        ]
 
 class Area:
+    __slots__ = ("center_x", "center_y", "width", "height", "area_type")
+
     def __init__(self, center_x, center_y, width, height, area_type):
         self.center_x = center_x
         self.center_y = center_y
@@ -851,38 +1701,303 @@ class Area:
             y <= self.center_y + self.height / 2
         )
 
-class EcosystemSimulator(arcade.Window):
-    def __init__(self):
-        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-        arcade.set_background_color(arcade.color.ARMY_GREEN)
+class InputRecorder:
+    # starting world, step sizes and user inputs of a session, enough to replay it headlessly,
+    # and the digest it ended with so a replay can tell when it diverged
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.seed = simulation.seed
+        self.sleeping = simulation.sleeping_enabled
+        self.world_scale = simulation.world_scale
+        self.world = [simulation.world_width, simulation.world_height]
+        self.checkpoint = simulation.checkpoint_path
+        self.tick = simulation.tick
+        self.delta_times = []
+        self.inputs = []
+
+    def record_step(self, delta_time):
+        self.delta_times.append(delta_time)
+
+    def record_input(self, tick, kind, args):
+        self.inputs.append([tick, kind, list(args)])
+
+    def save(self, path):
+        with open(path, "w") as log_file:
+            json.dump({"seed": self.seed, "sleeping": self.sleeping, "world_scale": self.world_scale, "world": self.world,
+                       "checkpoint": self.checkpoint, "tick": self.tick, "digest": self.simulation.state_digest(),
+                       "delta_times": self.delta_times, "inputs": self.inputs}, log_file)
+
+    @staticmethod
+    def load(path):
+        with open(path) as log_file:
+            return json.load(log_file)
+
+class TelemetrySink:
+    # samples population metrics every interval ticks into a preallocated ring buffer, each half of the
+    # ring is handed to a writer thread once filled so the simulation never waits on the file
+    def __init__(self, simulation, path, interval=10, capacity=1024):
+        self.simulation = simulation
+        self.path = path
+        self.interval = interval
+        self.format = os.path.splitext(path)[1].lstrip(".").lower()
+        if self.format not in ("csv", "npy", "parquet"):
+            raise ValueError(f"unsupported telemetry format '{self.format}', use .csv, .npy or .parquet")
+        if self.format == "parquet":
+            # fail here rather than on the writer thread, pyarrow is not one of the project's packages
+            try:
+                import pyarrow.parquet
+            except ImportError as error:
+                raise ImportError("writing .parquet telemetry needs pyarrow, install it or use .csv or .npy") from error
+
+        self.state_columns = []
+        for living_type in LivingType:
+            states = ANIMAL_TELEMETRY_STATES if living_type in (LivingType.RABBIT, LivingType.FOX) else PLANT_TELEMETRY_STATES
+            self.state_columns.extend((living_type, state) for state in states)
+
+        self.columns = (["tick", "time"] +
+                        [living_type.name.lower() for living_type in LivingType] +
+                        [f"{living_type.name.lower()}_{state.name.lower()}" for living_type, state in self.state_columns] +
+                        [f"{living_type.name.lower()}_health" for living_type in LivingType] +
+                        STRATEGIES[1:] +
+                        [f"collected_{resource}" for resource in CARD_COST_TYPES])
+
+        self.half = max(capacity // 2, 1)
+        self.ring = np.zeros((self.half * 2, len(self.columns)), dtype=np.float64)
+        self.written = 0
+        self.flushed = 0
+
+        self.blocks = queue.Queue()
+        # an exception on the writer thread is kept here and raised again by the next sample and by close
+        self.error = None
+        self.writer = threading.Thread(target=self.write_blocks, name="telemetry-writer", daemon=True)
+        self.writer.start()
+
+    def on_step(self):
+        if self.simulation.tick % self.interval == 0:
+            self.sample()
+
+    def sample(self):
+        self.check_writer()
+        simulation = self.simulation
+        population = simulation.population
+        store = simulation.store
+        row = self.ring[self.written % len(self.ring)]
+
+        column = 0
+        row[column] = simulation.tick
+        row[column + 1] = simulation.time
+        column += 2
+
+        counts = [population.count(living_type) for living_type in LivingType]
+        row[column:column + len(counts)] = counts
+        column += len(counts)
+
+        for living_type, state in self.state_columns:
+            row[column] = population.count_in_state(living_type, state)
+            column += 1
+
+        size = store.size
+        alive = store.alive[:size]
+        kinds = store.kind[:size][alive]
+        health_sums = np.bincount(kinds, store.health[:size][alive], minlength=len(LivingType))
+        health_counts = np.bincount(kinds, minlength=len(LivingType))
+        row[column:column + len(LivingType)] = health_sums / np.maximum(health_counts, 1)
+        column += len(LivingType)
+
+        strategies = dict.fromkeys(STRATEGIES[1:], 0)
+        for animal in population.alive_of(LivingType.RABBIT, LivingType.FOX):
+            strategies[animal.strategy] += 1
+        row[column:column + len(strategies)] = list(strategies.values())
+        column += len(strategies)
+
+        row[column:] = [simulation.resources_collected[resource] for resource in CARD_COST_TYPES]
+
+        self.written += 1
+        if self.written - self.flushed == self.half:
+            self.flush()
+
+    def flush(self):
+        # copies the rows not handed over yet, they never wrap since flushes happen every half ring
+        if self.written == self.flushed:
+            return
+
+        start = self.flushed % len(self.ring)
+        self.blocks.put(self.ring[start:start + self.written - self.flushed].copy())
+        self.flushed = self.written
+
+    def recent(self, rows=None):
+        # last rows sampled, oldest first, straight from the ring
+        available = min(self.written, len(self.ring))
+        rows = available if rows == None else min(rows, available)
+        indexes = np.arange(self.written - rows, self.written) % len(self.ring)
+        return self.ring[indexes]
+
+    def close(self):
+        self.flush()
+        self.blocks.put(None)
+        self.writer.join()
+        self.check_writer()
+
+    def check_writer(self):
+        if self.error is not None:
+            raise self.error
+
+    def write_blocks(self):
+        try:
+            self.write_format()
+        except Exception as error:
+            self.error = error
+
+    def write_format(self):
+        if self.format == "csv":
+            with open(self.path, "w") as telemetry_file:
+                telemetry_file.write(",".join(self.columns) + "\n")
+                while (block := self.blocks.get()) is not None:
+                    np.savetxt(telemetry_file, block, delimiter=",", fmt="%.10g")
+                    telemetry_file.flush()
+        elif self.format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+
+            schema = pyarrow.schema([(name, pyarrow.float64()) for name in self.columns])
+            with pyarrow.parquet.ParquetWriter(self.path, schema) as writer:
+                while (block := self.blocks.get()) is not None:
+                    writer.write_table(pyarrow.Table.from_arrays(list(block.T), schema=schema))
+        else:
+            # an .npy header needs the final row count, so blocks are only joined on close
+            blocks = []
+            while (block := self.blocks.get()) is not None:
+                blocks.append(block)
+            np.save(self.path, np.concatenate(blocks) if blocks else np.zeros((0, len(self.columns))))
+
+class FrameProfiler:
+    # wall time of every phase of a step or a draw, kept over the last frames for rolling percentiles;
+    # while disabled every call returns right away
+    def __init__(self, frames=300, by_class=False):
+        self.enabled = False
+        self.by_class = by_class
+        self.frames = frames
+        self.samples = {}
+        self.current = {}
+        self.frame_start = 0
+        self.last = 0
+
+    def begin(self):
+        if not self.enabled:
+            return
+
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0) + now - self.last
+        self.last = now
+
+    def add(self, name, elapsed):
+        self.current[name] = self.current.get(name, 0) + elapsed
+
+    def end(self, name):
+        if not self.enabled:
+            return
+
+        self.current[name] = time.perf_counter() - self.frame_start
+        for phase, elapsed in self.current.items():
+            if phase not in self.samples:
+                self.samples[phase] = collections.deque(maxlen=self.frames)
+            self.samples[phase].append(elapsed)
+        self.current.clear()
+
+    def summary(self):
+        # milliseconds per phase
+        summary = {}
+        for phase, samples in self.samples.items():
+            values = np.array(samples) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[phase] = {"p50": p50, "p95": p95, "p99": p99, "mean": values.mean(), "max": values.max(), "frames": len(values)}
+        return summary
+
+    def dump(self, path):
+        with open(path, "w") as profile_file:
+            json.dump(self.summary(), profile_file, indent=2)
+
+    def overlay_lines(self):
+        lines = ["phase  p50 / p95 / p99 ms"]
+        for phase, stats in self.summary().items():
+            lines.append(f"{phase}  {stats['p50']:.2f} / {stats['p95']:.2f} / {stats['p99']:.2f}")
+        return lines
+
+class Simulation:
+    def __init__(self, seed=None, populate=True, world_width=WORLD_WIDTH, world_height=WORLD_HEIGHT, counts=None):
+        self.seed = seed if seed != None else random.randrange(2 ** 32)
+        self.world_width = world_width
+        self.world_height = world_height
+        self.random = random.Random(self.seed)
+        self.recorder = None
+        # how the starting world was made, a recording replays from the same one
+        self.world_scale = 1 if populate else None
+        self.checkpoint_path = None
+        self.telemetry = None
+        self.profiler = FrameProfiler()
+        # chunks away from predators, busy animals and due timers sleep between their staggered updates
+        self.chunks = ChunkGrid(self)
+        # opt-in, a sleeping entity catches up its banked time in one longer update, which changes the dynamics
+        self.sleeping_enabled = False
+        self.awake_slots = None
+        # sensing is only true during the sense phase of the entity updates
+        self.phases = TwoPhaseUpdate(self)
+        self.sensing = False
+
+        self.store = EntityStore()
+        self.plant_density = PlantDensity(world_width, world_height, PLANT_NUTRIENT_RADIUS)
+        self.population = PopulationRegistry(self.plant_density)
+        self.scheduler = RoutineScheduler(self)
         self.spatial_grid = SpatialHashGrid(cell_size=RABBIT_PERCEPTION_RADIUS)
         self.plant_spatial_grid = SpatialHashGrid(cell_size=PLANT_NUTRIENT_RADIUS)
-
-        self.entities = arcade.SpriteList()
-        self.bushes = arcade.SpriteList()
-        self.preys = arcade.SpriteList()
-        self.predators = arcade.SpriteList()
-        self.grass_patches = arcade.SpriteList()
+        self.predator_spatial_grid = SpatialHashGrid(cell_size=DETECTION_RANGE)
+
+        # a checkpoint load passes the number of entities of each LivingType so the sprite lists start at their size
+        counts = counts or {}
+        self.entities = arcade.SpriteList(capacity=sum(counts.values()) or 100)
+        self.bushes = arcade.SpriteList(capacity=counts.get(LivingType.PLANT, 100))
+        self.preys = arcade.SpriteList(capacity=counts.get(LivingType.RABBIT, 100))
+        self.predators = arcade.SpriteList(capacity=counts.get(LivingType.FOX, 100))
+        self.grass_patches = arcade.SpriteList(capacity=counts.get(LivingType.GRASS, 100))
         self.cards = arcade.SpriteList()
 
         self.open_areas = []
         self.covered_areas = []
         self.areas = []
 
-        self.define_areas()
-
-        self.initialize_bushes(50)
-        self.initialize_grass_patches(75)
-        self.initialize_preys(50)
-        self.initialize_predators(4)
-        self.initialize_cards()
+        self.tick = 0
+        self.time = 0
 
         self.resources_collected = { "fox": 0, "rabbit": 0, "bush": 0, "grass": 0 }
 
-        self.hide_cards = True
-        self.is_debugging = False
-
         self.prey_social_controller = PreySocialController(self)
+
+        if populate:
+            self.populate()
+
+    @classmethod
+    def with_world_scale(cls, world_scale, seed=None):
+        # world_scale times the screen on each side, populated with the default density
+        simulation = cls(seed=seed, populate=False, world_width=round(WORLD_WIDTH * world_scale), world_height=round(WORLD_HEIGHT * world_scale))
+        area = world_scale * world_scale
+        simulation.populate(bushes=round(50 * area), grass_patches=round(75 * area), preys=round(50 * area), predators=round(4 * area))
+        simulation.world_scale = world_scale
+        return simulation
+
+    def populate(self, bushes=50, grass_patches=75, preys=50, predators=4):
+        self.define_areas()
+
+        self.initialize_bushes(bushes)
+        self.initialize_grass_patches(grass_patches)
+        self.initialize_preys(preys)
+        self.initialize_predators(predators)
+        self.initialize_cards()
     
     def initialize_cards(self):
         card_number = 5
@@ -934,47 +2049,45 @@ class EcosystemSimulator(arcade.Window):
         }
 
     def global_heal(self):
-        animals = arcade.SpriteList()
-        animals.extend(self.preys)
-        animals.extend(self.predators)
-
-        for animal in animals:
-            if animal.current_state != LivingBeingStates.DEAD:
-                animal.health = animal.initial_health
+        for animal in self.population.alive_of(LivingType.RABBIT, LivingType.FOX):
+            animal.health = animal.initial_health
 
     def make_rabbit_hungry(self):
-        animals = arcade.SpriteList()
-        animals.extend(self.preys)
-
-        animal_list = list(animals)
-        random_rabbits = random.sample(animal_list, min(3, len(animal_list)))
+        animal_list = list(self.population.alive_of(LivingType.RABBIT))
+        random_rabbits = self.random.sample(animal_list, min(3, len(animal_list)))
 
         for rabbit in random_rabbits:
             rabbit.force_hungry()
 
     def get_random_card(self, card_type_obj):
-        card_type = random.sample(CARD_TYPES, 1)[0]
-        current_card_type_obj = card_type_obj[card_type]
-        card = CardSprite(current_card_type_obj, self)
+        card_type = self.random.sample(CARD_TYPES, 1)[0]
+        return self.create_card(card_type, card_type_obj)
+
+    def create_card(self, card_type, card_type_obj):
+        card = CardSprite(card_type_obj[card_type], self)
+        card.card_type = card_type
         return card
     
     def define_areas(self):
-        grid_size_x = GRID_UNIT_X
-        grid_size_y = GRID_UNIT_Y
-        cell_width = SCREEN_WIDTH / grid_size_x
-        cell_height = SCREEN_HEIGHT / grid_size_y
+        # areas keep the size of a screen grid cell, a larger world just has more of them
+        grid_size_x = max(round(self.world_width / GRID_OFFSET_X), 1)
+        grid_size_y = max(round(self.world_height / GRID_OFFSET_Y), 1)
+        cell_width = self.world_width / grid_size_x
+        cell_height = self.world_height / grid_size_y
 
         for i in range(grid_size_x):
             for j in range(grid_size_y):
-                area_type = random.choice(['open', 'covered'])
+                area_type = self.random.choice(['open', 'covered'])
                 center_x = (i + 0.5) * cell_width
                 center_y = (j + 0.5) * cell_height
-                area = Area(center_x, center_y, cell_width, cell_height, area_type)
-                self.areas.append(area)
-                if area_type == 'open':
-                    self.open_areas.append(area)
-                else:
-                    self.covered_areas.append(area)
+                self.add_area(Area(center_x, center_y, cell_width, cell_height, area_type))
+
+    def add_area(self, area):
+        self.areas.append(area)
+        if area.area_type == 'open':
+            self.open_areas.append(area)
+        else:
+            self.covered_areas.append(area)
 
     def initialize_bushes(self, bush_number):
         num_clusters = bush_number // 5
@@ -997,14 +2110,14 @@ class EcosystemSimulator(arcade.Window):
         if not self.open_areas:
             return
     
-        area = random.choice(self.open_areas)
-        posX = random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2)
-        posY = random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2)
+        # grass spreads toward the less crowded spots of the area
+        area = self.random.choice(self.open_areas)
+        candidates = [(self.random.uniform(area.center_x - area.width / 2, area.center_x + area.width / 2),
+                       self.random.uniform(area.center_y - area.height / 2, area.center_y + area.height / 2))
+                      for _ in range(GRASS_SPAWN_CANDIDATES)]
+        posX, posY = self.plant_density.sparsest(candidates)
         grass_patch = GrassPatchSprite(posX, posY, self)
-        self.grass_patches.append(grass_patch)
-        self.entities.append(grass_patch)
-
-        self.plant_spatial_grid.add_sprite(grass_patch)
+        self.spawn(grass_patch, self.grass_patches, self.plant_spatial_grid)
 
     def add_bush(self):
         # posX, posY = randomIntXY([1, SCREEN_WIDTH - 1], [1, SCREEN_HEIGHT - 1])
@@ -1012,183 +2125,877 @@ class EcosystemSimulator(arcade.Window):
         # self.bushes.append(bush)
         # self.entities.append(bush)
 
-        area_type_choice = random.choices(['covered', 'open'], weights=[0.9, 0.1])[0]
+        area_type_choice = self.random.choices(['covered', 'open'], weights=[0.9, 0.1])[0]
         if area_type_choice == 'open' and self.open_areas:
-            area = random.choice(self.open_areas)
+            area = self.random.choice(self.open_areas)
         elif self.covered_areas:
-            area = random.choice(self.covered_areas)
+            area = self.random.choice(self.covered_areas)
         else:
             return
     
-        cluster_center_x = random.uniform(area.center_x - area.width / 4, area.center_x + area.width / 4)
-        cluster_center_y = random.uniform(area.center_y - area.height / 4, area.center_y + area.height / 4)
+        cluster_center_x = self.random.uniform(area.center_x - area.width / 4, area.center_x + area.width / 4)
+        cluster_center_y = self.random.uniform(area.center_y - area.height / 4, area.center_y + area.height / 4)
 
-        for _ in range(random.randint(3, 7)):
-            posX = random.gauss(cluster_center_x, area.width / 7)
-            posY = random.gauss(cluster_center_y, area.height / 7)
+        for _ in range(self.random.randint(3, 7)):
+            posX = self.random.gauss(cluster_center_x, area.width / 7)
+            posY = self.random.gauss(cluster_center_y, area.height / 7)
 
             can_add_plant = self.can_add_plant(posX, posY)
             if not can_add_plant:
                 return
 
             bush = BushSprite(posX, posY, self)
-            self.bushes.append(bush)
-            self.entities.append(bush)
-            self.plant_spatial_grid.add_sprite(bush)
+            self.spawn(bush, self.bushes, self.plant_spatial_grid)
     
     def can_add_plant(self, pos_x, pos_y):
-        plants_nearby = self.plant_spatial_grid.get_nearby_sprites(pos_x, pos_y)
-        if len(plants_nearby) > 5:
-            return False
-
-        return True
+        # dead plants waiting for their removal no longer count
+        return self.plant_density.nearby_count(pos_x, pos_y) <= PLANT_CROWDING_LIMIT
     
+    def match_mates(self):
+        for living_type, spatial_grid in ((LivingType.RABBIT, self.spatial_grid), (LivingType.FOX, self.predator_spatial_grid)):
+            reproducing = self.population.members_in_state(living_type, AnimalStates.REPRODUCING)
+
+            waiting = []
+            for animal in reproducing:
+                if animal.has_mate() and animal.current_target_object.current_target_object is not animal:
+                    # the partner gave up on us, e.g. to look for food
+                    animal.current_target_object = None
+
+                if not animal.has_mate():
+                    waiting.append(animal)
+                    continue
+
+                mate = animal.current_target_object
+                if animal.current_state == AnimalStates.REPRODUCING and mate.current_state not in DEAD_STATES:
+                    distance = get_square_distance(animal.center_x, animal.center_y, mate.center_x, mate.center_y)
+                    if distance < INTERACT_RANGE * INTERACT_RANGE:
+                        animal.reproduce(mate)
+
+            matched = set()
+            for animal in waiting:
+                if animal in matched or animal.current_state != AnimalStates.REPRODUCING:
+                    continue
+
+                def can_mate(candidate):
+                    if candidate is animal or candidate in matched or candidate.current_state in DEAD_STATES:
+                        return False
+                    return candidate.current_state != AnimalStates.REPRODUCING or not candidate.has_mate()
+
+                mate = spatial_grid.nearest(animal.center_x, animal.center_y, can_mate)
+                if mate is None:
+                    continue
+
+                matched.add(animal)
+                matched.add(mate)
+                mate.current_state = AnimalStates.REPRODUCING
+                mate.current_target_object = animal
+                animal.current_target_object = mate
+
+    def entities_in_rect(self, left, bottom, right, top):
+        for spatial_grid in (self.plant_spatial_grid, self.spatial_grid, self.predator_spatial_grid):
+            yield from spatial_grid.query_rect(left, bottom, right, top)
+
+    def nearest_food(self, x, y):
+        return self.plant_spatial_grid.nearest(x, y, is_alive)
+
     def add_prey(self, coords=None):
         if coords:
             posX, posY = coords
         else:
-            posX, posY = random_int_xy([1, SCREEN_WIDTH - 1], [1, SCREEN_HEIGHT - 1])
+            posX, posY = random_int_xy([1, self.world_width - 1], [1, self.world_height - 1], self.random)
 
-        prey = PreySprite(posX, posY, self.bushes, self.grass_patches, self)
-        self.preys.append(prey)
-        self.entities.append(prey)
+        prey = PreySprite(posX, posY, self)
+        self.spawn(prey, self.preys, self.spatial_grid)
     
     def add_predator(self, coords=None):
         if coords:
             posX, posY = coords
         else:
-            posX, posY = random_int_xy([1, SCREEN_WIDTH - 1], [1, SCREEN_HEIGHT - 1])
+            posX, posY = random_int_xy([1, self.world_width - 1], [1, self.world_height - 1], self.random)
 
         predator = PredatorSprite(posX, posY, self)
-        self.entities.append(predator)
-        self.predators.append(predator)
+        self.spawn(predator, self.predators, self.predator_spatial_grid)
+
+    def spawn(self, entity, sprite_list, spatial_grid):
+        self.entities.append(entity)
+        sprite_list.append(entity)
+        self.store.allocate(entity)
+        spatial_grid.add_sprite(entity)
+        self.population.on_spawn(entity)
+
+    def remove_entity(self, entity):
+        if self.sensing:
+            return self.phases.defer(self.remove_entity, entity)
+
+        if entity.slot is not None:
+            self.population.on_removed(entity)
+        entity.remove_from_sprite_lists()
+        self.spatial_grid.remove(entity)
+        self.plant_spatial_grid.remove(entity)
+        self.predator_spatial_grid.remove(entity)
+        self.store.release(entity)
+
+    def step(self, delta_time=SIMULATION_TIMESTEP):
+        profiler = self.profiler
+        profiler.begin()
+
+        for prey in self.preys:
+            self.spatial_grid.move(prey)
+        for predator in self.predators:
+            self.predator_spatial_grid.move(predator)
+        profiler.lap("spatial grids")
+
+        moved = self.store.integrate_velocities(delta_time, LivingType.RABBIT, self.world_width, self.world_height)
+        self.store.push_positions(moved)
+        profiler.lap("integrate velocities")
+
+        self.scheduler.advance(self.time)
+        profiler.lap("scheduler")
+        self.match_mates()
+        profiler.lap("match mates")
+
+        self.awake_slots = self.chunks.awake_slots(delta_time) if self.sleeping_enabled else None
+        profiler.lap("chunks")
+
+        # per class timing shares one dict, so it is left out when the partitions run on threads
+        if profiler.enabled and profiler.by_class and not self.phases.executor:
+            self.sense_entities_by_class(delta_time)
+        else:
+            update_entity = self.update_entity
+            self.phases.sense(self.entities, lambda entity: update_entity(entity, delta_time))
+        profiler.lap("entities sense")
+        self.phases.act()
+        profiler.lap("entities act")
+
+        self.prey_social_controller.update(delta_time)
+        profiler.lap("prey social controller")
+
+        self.tick += 1
+        self.time += delta_time
+
+        if self.recorder:
+            self.recorder.record_step(delta_time)
+        if self.telemetry:
+            self.telemetry.on_step()
+        profiler.lap("recording and telemetry")
+        profiler.end("step")
+
+    def entity_random(self):
+        # while sensing every entity draws from its own stream, so draws do not depend on the update order
+        return self.phases.random() if self.sensing else self.random
+
+    def is_awake(self, entity):
+        # entities spawned during this tick are past the end of awake_slots and count as awake
+        awake = self.awake_slots
+        return awake is None or entity.slot is None or entity.slot >= len(awake) or awake[entity.slot]
+
+    def update_entity(self, entity, delta_time):
+        # a sleeping entity banks its time and gets all of it on its next update
+        if not self.is_awake(entity):
+            entity.sleep_debt += delta_time
+            return
+        entity.update(delta_time + entity.sleep_debt)
+        entity.sleep_debt = 0
+
+    def sense_entities_by_class(self, delta_time):
+        # same sense phase, timing each entity class on the side
+        clock = time.perf_counter
+        profiler = self.profiler
+        update_entity = self.update_entity
+        by_class = {}
+
+        def timed_update(entity):
+            start = clock()
+            update_entity(entity, delta_time)
+            entity_class = type(entity)
+            by_class[entity_class] = by_class.get(entity_class, 0) + clock() - start
+
+        self.phases.sense(self.entities, timed_update)
+
+        for entity_class, elapsed in by_class.items():
+            profiler.add(f"{entity_class.__name__}.update", elapsed)
+
+    def run(self, ticks, delta_time=SIMULATION_TIMESTEP):
+        for _ in range(ticks):
+            self.step(delta_time)
+
+    def start_parallel(self, workers):
+        self.phases.set_workers(workers)
+        return self.phases
+
+    def start_profiling(self, by_class=False):
+        # timing every entity update by class costs two clock reads per entity, so it is opt-in
+        self.profiler.enabled = True
+        self.profiler.by_class = by_class
+        return self.profiler
+
+    def start_telemetry(self, path, interval=10):
+        self.telemetry = TelemetrySink(self, path, interval)
+        return self.telemetry
+
+    def start_recording(self):
+        if self.checkpoint_path is None and self.world_scale is None:
+            raise ValueError("only a world loaded from a checkpoint or populated by with_world_scale can be recorded")
+        self.recorder = InputRecorder(self)
+        return self.recorder
+
+    def handle_input(self, kind, *args):
+        # every user input goes through here so it can be recorded and replayed
+        if self.recorder:
+            self.recorder.record_input(self.tick, kind, args)
+
+        if kind == "collect":
+            self.collect_at(*args)
+        elif kind == "use_card":
+            self.use_card(*args)
+
+    def use_card(self, index):
+        for card in self.cards:
+            if card.index == index:
+                card.use()
+                return
+
+    @classmethod
+    def replay(cls, log):
+        if log["checkpoint"]:
+            simulation = cls.load_checkpoint(log["checkpoint"])
+        else:
+            simulation = cls.with_world_scale(log["world_scale"], log["seed"])
+        if [simulation.world_width, simulation.world_height] != log["world"] or simulation.tick != log["tick"]:
+            raise ValueError("the recording did not start from the world it names, it cannot be replayed")
+        simulation.sleeping_enabled = log["sleeping"]
+        inputs = log["inputs"]
+        next_input = 0
+
+        for delta_time in log["delta_times"]:
+            while next_input < len(inputs) and inputs[next_input][0] <= simulation.tick:
+                _, kind, args = inputs[next_input]
+                simulation.handle_input(kind, *args)
+                next_input += 1
+            simulation.step(delta_time)
+
+        for _, kind, args in inputs[next_input:]:
+            simulation.handle_input(kind, *args)
+
+        if simulation.state_digest() != log["digest"]:
+            raise ValueError("the replay diverged from the recording, it ended in a different state")
+        return simulation
+
+    def state_digest(self):
+        store = self.store
+        slots = np.array([entity.slot for entity in self.entities], dtype=np.int64)
+        digest = hashlib.sha256()
+        digest.update(np.array([self.tick], dtype=np.int64).tobytes())
+        for column in (store.kind, store.x, store.y, store.vx, store.vy, store.health, store.state, store.timers):
+            digest.update(column[slots].tobytes())
+        digest.update(json.dumps(self.resources_collected, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def save_checkpoint(self, path):
+        # one .npy per column plus meta.json, so load_checkpoint can memory map every column
+        entities = list(self.entities)
+        store = self.store
+        slots = np.array([entity.slot for entity in entities], dtype=np.int32)
+
+        # targets already removed from the world are saved after the world's entities, without a slot,
+        # so the animals still following them go on exactly as before
+        detached = self.detached_targets(entities)
+        rows = entities + detached
+        detached_columns = store.detached_rows(detached)
+        columns = {column: np.concatenate([getattr(store, column)[slots], detached_columns[column]]) for column in CHECKPOINT_STORE_COLUMNS}
+        columns["slot"] = np.concatenate([slots, np.full(len(detached), -1, dtype=np.int32)])
+        index_of = {entity: index for index, entity in enumerate(rows)}
+        targets = [getattr(entity, "current_target_object", None) for entity in rows]
+        columns["target_row"] = np.array([-1 if target is None else index_of[target] for target in targets], dtype=np.int32)
+        columns["due_routines"] = np.array([entity.due_routines for entity in rows], dtype=np.int32)
+        columns["bar_health"] = np.array([np.nan if entity.health_bar is None else entity.health_bar.current_health for entity in rows], dtype=np.float64)
+        columns["last_damage_time"] = np.array([np.nan if entity.last_damage_time == None else entity.last_damage_time for entity in rows], dtype=np.float64)
+        columns["life_expectancy"] = np.array([entity.life_expectancy for entity in rows], dtype=np.float64)
+        columns["sleep_debt"] = np.array([entity.sleep_debt for entity in rows], dtype=np.float64)
+        columns["movement_speed"] = np.array([getattr(entity, "movement_speed", 0) for entity in rows], dtype=np.float64)
+        columns["hungry_time_to_fulfill"] = np.array([getattr(entity, "hungry_time_to_fulfill", 0) for entity in rows], dtype=np.float64)
+        columns["target_coord"] = np.array([getattr(entity, "current_target_coord", None) or (np.nan, np.nan) for entity in rows], dtype=np.float64).reshape(-1, 2)
+        columns["strategy"] = np.array([STRATEGIES.index(getattr(entity, "strategy", None)) for entity in rows], dtype=np.int8)
+
+        # iteration order inside the grids and the registry, so a restored world goes on exactly like the saved one
+        for name, groups in self.checkpoint_orders().items():
+            order = np.full(len(rows), -1, dtype=np.int32)
+            for members in groups:
+                for rank, entity in enumerate(members):
+                    order[index_of[entity]] = rank
+            columns[name] = order
+
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, name + ".npy"), column)
+
+        version, rng_state, gauss_next = self.random.getstate()
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "seed": self.seed,
+            "world": [self.world_width, self.world_height],
+            "tick": self.tick,
+            "time": self.time,
+            "sleeping": self.sleeping_enabled,
+            "random": [version, list(rng_state), gauss_next],
+            "resources_collected": self.resources_collected,
+            "areas": [[area.center_x, area.center_y, area.width, area.height, area.area_type] for area in self.areas],
+            "cards": [[card.card_type, card.index] for card in self.cards],
+            "entities": len(entities),
+            "detached": len(detached),
+            "store_size": store.size,
+            "free_slots": store.free_slots,
+        }
+        with open(os.path.join(path, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    def detached_targets(self, entities):
+        # removed entities some animal still targets, followed through their own targets too
+        detached = {}
+        pending = list(entities)
+        while pending:
+            target = getattr(pending.pop(), "current_target_object", None)
+            if target is not None and target.slot is None and target not in detached:
+                detached[target] = None
+                pending.append(target)
+        return list(detached)
+
+    def checkpoint_orders(self):
+        population = self.population
+        return {
+            "grid_order": [spatial_grid.sprite_keys for spatial_grid in (self.spatial_grid, self.plant_spatial_grid, self.predator_spatial_grid)],
+            "alive_order": list(population.alive.values()),
+            "state_order": [members for by_state in population.in_state.values() for members in by_state.values()],
+        }
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["version"] != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version {meta['version']}")
+
+        columns = {}
+        for name in CHECKPOINT_STORE_COLUMNS + CHECKPOINT_EXTRA_COLUMNS:
+            columns[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        world_width, world_height = meta["world"]
+        kinds = np.bincount(columns["kind"][:meta["entities"]], minlength=len(LivingType))
+        simulation = cls(seed=meta["seed"], populate=False, world_width=world_width, world_height=world_height,
+                         counts=dict(zip(LivingType, kinds.tolist())))
+        simulation.checkpoint_path = os.path.abspath(path)
+        simulation.tick = meta["tick"]
+        simulation.time = meta["time"]
+        simulation.sleeping_enabled = meta["sleeping"]
+        simulation.resources_collected = meta["resources_collected"]
+
+        for center_x, center_y, width, height, area_type in meta["areas"]:
+            simulation.add_area(Area(center_x, center_y, width, height, area_type))
+
+        card_type_obj = simulation.card_types_func()
+        for card_type, index in meta["cards"]:
+            card = simulation.create_card(card_type, card_type_obj)
+            card.set_index(index)
+            simulation.cards.append(card)
+
+        # a load makes about a dozen tracked objects per entity and none of them can be garbage yet,
+        # the collections they would set off on the way only rescan them
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            simulation.restore_entities(columns, meta)
+        finally:
+            if collecting:
+                gc.enable()
+
+        version, rng_state, gauss_next = meta["random"]
+        simulation.random.setstate((version, tuple(rng_state), gauss_next))
+        return simulation
+
+    def restore_entities(self, columns, meta):
+        # entities come from the lightweight LivingBeing.restore and are bound to the store slots they were saved from,
+        # the store columns are copied from the mapped files in bulk and the registry, grids and scheduler filled in bulk
+        count = meta["entities"]
+        total = count + meta["detached"]
+        # only the values kept on the entities themselves are turned into Python objects
+        values = {name: columns[name][:total].tolist() for name in CHECKPOINT_ENTITY_COLUMNS}
+        x, y, health, state = values["x"], values["y"], values["health"], values["state"]
+        bar_health, last_damage_time, due_routines = values["bar_health"], values["last_damage_time"], values["due_routines"]
+        life_expectancy, sleep_debt, strategy = values["life_expectancy"], values["sleep_debt"], values["strategy"]
+        movement_speed, hungry_time_to_fulfill = values["movement_speed"], values["hungry_time_to_fulfill"]
+        target_x, target_y = (columns["target_coord"][:total, axis].tolist() for axis in (0, 1))
+
+        kinds_of = self.kinds_of()
+        entity_classes = [kinds_of[living_type][0] for living_type in LivingType]
+        restore = [entity_class.restore for entity_class in entity_classes]
+        is_animal = [issubclass(entity_class, Animal) for entity_class in entity_classes]
+        isnan = math.isnan
+
+        rows = []
+        for i, kind in enumerate(values["kind"]):
+            entity = restore[kind](self, x[i], y[i])
+            # before the slot is bound the mirrored fields only write the entity itself
+            entity.health = health[i]
+            entity.current_state = STATE_MEMBERS[state[i]]
+            if not isnan(bar_health[i]):
+                entity.health_bar = HealthBar(entity.initial_health)
+                entity.health_bar.current_health = bar_health[i]
+            if not isnan(last_damage_time[i]):
+                entity.last_damage_time = last_damage_time[i]
+            entity.life_expectancy = life_expectancy[i]
+            entity.sleep_debt = sleep_debt[i]
+            entity.due_routines = due_routines[i]
+
+            if is_animal[kind]:
+                entity.movement_speed = movement_speed[i]
+                entity.hungry_time_to_fulfill = hungry_time_to_fulfill[i]
+                entity.current_target_coord = None if isnan(target_x[i]) else [target_x[i], target_y[i]]
+                entity.strategy = STRATEGIES[strategy[i]]
+
+            rows.append(entity)
+
+        # the detached targets at the end only get their field values back, they are not part of the world
+        entities = rows[:count]
+        store = self.store
+        store.load_rows(entities, values["slot"][:count], {column: columns[column][:count] for column in CHECKPOINT_STORE_COLUMNS},
+                        meta["store_size"], meta["free_slots"])
+        for i in range(count, total):
+            store.load_detached(rows[i], {column: np.asarray(columns[column][i]).tolist() for column in CHECKPOINT_STORE_COLUMNS})
+
+        for entity, target_row in zip(rows, values["target_row"]):
+            if target_row >= 0:
+                entity.__dict__["current_target_object"] = rows[target_row]
+
+        # sprite lists, grids and registry sets are filled per kind, each in its saved order
+        kinds = np.asarray(columns["kind"][:count])
+        states = np.asarray(columns["state"][:count])
+        codes = {living_type: LIVING_TYPE_CODES[living_type] for living_type in LivingType}
+
+        def members(indexes):
+            return list(map(entities.__getitem__, indexes.tolist()))
+
+        self.entities.extend(entities)
+        for living_type, (_, sprite_list, _) in kinds_of.items():
+            sprite_list.extend(members(np.flatnonzero(kinds == codes[living_type])))
+
+        grid_order = self.in_checkpoint_order(columns["grid_order"], count)
+        for spatial_grid in (self.spatial_grid, self.plant_spatial_grid, self.predator_spatial_grid):
+            grid_codes = [codes[living_type] for living_type, (_, _, kind_grid) in kinds_of.items() if kind_grid is spatial_grid]
+            spatial_grid.add_sprites(members(grid_order[np.isin(kinds[grid_order], grid_codes)]))
+
+        alive_order = self.in_checkpoint_order(columns["alive_order"], count)
+        alive = {living_type: members(alive_order[kinds[alive_order] == code]) for living_type, code in codes.items()}
+        state_order = self.in_checkpoint_order(columns["state_order"], count)
+        in_state = {}
+        for living_type, code in codes.items():
+            of_type = state_order[kinds[state_order] == code]
+            for state in np.unique(states[of_type]).tolist():
+                in_state[living_type, STATE_MEMBERS[state]] = members(of_type[states[of_type] == state])
+        self.population.on_restored(alive, in_state)
+
+        # the queue is rebuilt from scratch with every routine whose bit has not been raised yet
+        sizes = np.array([entity_class.due_times.size for entity_class in entity_classes])
+        routines = np.arange(store.timers.shape[1])
+        pending = ((np.asarray(columns["due_routines"][:count])[:, None] >> routines) & 1) == 0
+        pending &= routines < sizes[np.asarray(columns["kind"][:count])][:, None]
+        indexes, pending_routines = np.nonzero(pending)
+        due_times = np.asarray(columns["timers"][:count])[indexes, pending_routines]
+
+        # entries are numbered in row order and sorted by due time then number, a sorted list is already a heap
+        order = np.argsort(due_times, kind="stable")
+        self.scheduler.queue = list(zip(due_times[order].tolist(), order.tolist(), pending_routines[order].tolist(),
+                                        map(entities.__getitem__, indexes[order].tolist())))
+        self.scheduler.sequence = itertools.count(len(order))
+
+    def in_checkpoint_order(self, order, count):
+        # indexes of the first count entities that have a rank, by rank and then by index
+        order = np.asarray(order[:count])
+        indexes = np.flatnonzero(order >= 0)
+        return indexes[np.argsort(order[indexes], kind="stable")]
+
+    def kinds_of(self):
+        # entity class, sprite list and spatial index of every LivingType
+        return {
+            LivingType.RABBIT: (PreySprite, self.preys, self.spatial_grid),
+            LivingType.FOX: (PredatorSprite, self.predators, self.predator_spatial_grid),
+            LivingType.PLANT: (BushSprite, self.bushes, self.plant_spatial_grid),
+            LivingType.GRASS: (GrassPatchSprite, self.grass_patches, self.plant_spatial_grid),
+        }
+
+    def population_counts(self):
+        # preys, predators, bushes and grass patches alive, in LivingType order
+        return tuple(self.population.count(living_type) for living_type in LivingType)
+
+    def collect_at(self, x, y):
+        sprites_clicked = arcade.get_sprites_at_point((x, y), self.entities)
+
+        if len(sprites_clicked) > 0:
+            sprite_clicked = sorted(sprites_clicked, key=lambda entity: entity.bottom, reverse=False)[0]
+        else:
+            sprite_clicked = None
+        
+        if sprite_clicked is not None:
+            if sprite_clicked.type == LivingType.RABBIT:
+                self.resources_collected["rabbit"] += 1
+            
+            if sprite_clicked.type == LivingType.FOX:
+                self.resources_collected["fox"] += 1
+            
+            if sprite_clicked.type == LivingType.PLANT:
+                self.resources_collected["bush"] += 1
+            
+            if sprite_clicked.type == LivingType.GRASS:
+                self.resources_collected["grass"] += 1
+
+            self.remove_entity(sprite_clicked)
+
+class EcosystemSimulator(arcade.Window):
+    def __init__(self, simulation=None, record_path=None):
+        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+        arcade.set_background_color(arcade.color.ARMY_GREEN)
+
+        self.simulation = simulation if simulation else Simulation()
+        self.record_path = record_path
+        if record_path:
+            self.simulation.start_recording()
+
+        self.hide_cards = True
+        self.is_debugging = False
+        self.is_profiling = False
+        self.overlays = OverlayLayer()
+
+        # the world is drawn through a pan and zoom camera, cards and HUD through a fixed one
+        self.camera = arcade.camera.Camera2D()
+        self.gui_camera = arcade.camera.Camera2D()
+        self.pan_keys = set()
+
+        # text is laid out once here and only touched again when what it shows changes
+        self.hud_batch = pyglet.graphics.Batch()
+        self.resources_text = arcade.Text("", 15, SCREEN_HEIGHT - 35, arcade.color.WHITE, 20, batch=self.hud_batch)
+        self.shown_resources = None
+        self.speed_text = arcade.Text("", SCREEN_WIDTH - 15, SCREEN_HEIGHT - 35, arcade.color.WHITE, 20, anchor_x="right", batch=self.hud_batch)
+        self.step_accumulator = 0
+        self.set_speed(0)
+        self.create_key_instructions()
+        self.game_over_text = arcade.Text("Game Over", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, arcade.color.WHITE, 28,
+                                          bold=True, anchor_x="center", anchor_y="center")
+
+        self.card_batch = None
+        self.card_texts = []
+        self.shown_cards = None
+
+        self.profiler_batch = pyglet.graphics.Batch()
+        self.profiler_texts = []
 
     def on_draw(self):
         arcade.get_window().clear()
-
+        simulation = self.simulation
+        profiler = simulation.profiler
+        profiler.begin()
+
+        # aging tints and overlays are only worked out for what is in view, once per frame however many steps ran
+        # tinted here and given overlays below, so the lazy query is gathered once
+        visible_entities = list(simulation.entities_in_rect(*self.visible_rect()))
+        for entity in visible_entities:
+            if entity.type in (LivingType.RABBIT, LivingType.FOX):
+                entity.update_tint()
+
+        self.camera.use()
         # In new Arcade, we draw the whole list at once.
-        self.entities.draw(pixelated=True)
+        simulation.entities.draw(pixelated=True)
+        profiler.lap("draw sprites")
 
         # Now draw the custom overlays on top of the sprites.
-        if self.preys:
-            first_rabbit = self.preys[0]
-            if self.is_debugging:
+        if simulation.preys:
+            first_rabbit = simulation.preys[0]
+            if self.is_debugging and self.is_visible(first_rabbit.center_x, first_rabbit.center_y):
                 first_rabbit.draw_perception_circle()
 
-        # Draw health bars and needs icons for all entities
-        for entity in self.entities:
-            entity.on_draw()
+        # Draw health bars and needs icons for the entities in view
+        self.overlays.update(visible_entities, simulation.time)
+        self.overlays.draw()
+        profiler.lap("draw entity overlays")
+
+        self.gui_camera.use()
 
         # Draw cards and their text overlays
         if not self.hide_cards:
-            self.cards.draw()
-            for card in self.cards:
-                card.draw_overlays() 
+            simulation.cards.draw()
+            self.update_card_texts()
+            self.card_batch.draw()
+        profiler.lap("draw cards")
 
         # Draw UI elements
+        resources_collected = simulation.resources_collected
+        resources = (resources_collected['rabbit'], resources_collected['fox'], resources_collected['bush'], resources_collected['grass'])
+        if resources != self.shown_resources:
+            self.resources_text.text = "r (rabbit): {}, f (fox): {}, b (bush): {}, g (grass): {}".format(*resources)
+            self.shown_resources = resources
+
         arcade.draw_lrbt_rectangle_filled(0, SCREEN_WIDTH, SCREEN_HEIGHT - 50, SCREEN_HEIGHT, (0, 0, 0, 150))
-        arcade.draw_text(f"r (rabbit): {self.resources_collected['rabbit']}, f (fox): {self.resources_collected['fox']}, b (bush): {self.resources_collected['bush']}, g (grass): {self.resources_collected['grass']}",
-                        15, SCREEN_HEIGHT - 35, arcade.color.WHITE, 20)
-        
         self.draw_key_instructions()
+        profiler.lap("draw hud")
+
+        if self.is_profiling:
+            self.draw_profiler_overlay()
+        profiler.end("draw")
     
-    def draw_key_instructions(self):
+    def visible_rect(self):
+        x, y = self.camera.position
+        half_width = self.width / 2 / self.camera.zoom + CULLING_MARGIN
+        half_height = self.height / 2 / self.camera.zoom + CULLING_MARGIN
+        return x - half_width, y - half_height, x + half_width, y + half_height
+
+    def is_visible(self, x, y):
+        left, bottom, right, top = self.visible_rect()
+        return left <= x <= right and bottom <= y <= top
+
+    def move_camera(self, dx, dy):
+        x, y = self.camera.position
+        x = max(0, min(x + dx, self.simulation.world_width))
+        y = max(0, min(y + dy, self.simulation.world_height))
+        self.camera.position = (x, y)
+
+    def zoom_camera(self, factor, x, y):
+        # the world point under the cursor stays under it
+        before = self.camera.unproject((x, y))
+        self.camera.zoom = max(CAMERA_MIN_ZOOM, min(self.camera.zoom * factor, CAMERA_MAX_ZOOM))
+        after = self.camera.unproject((x, y))
+        self.move_camera(before[0] - after[0], before[1] - after[1])
+
+    def update_card_texts(self):
+        # the card batch is rebuilt only when a card is used or the hand is reindexed
+        cards = [(card, card.index) for card in self.simulation.cards]
+        if cards == self.shown_cards:
+            return
+
+        self.card_batch = pyglet.graphics.Batch()
+        self.card_texts = [text for card, _ in cards for text in card.create_texts(self.card_batch)]
+        self.shown_cards = cards
+
+    def draw_profiler_overlay(self):
+        lines = self.simulation.profiler.overlay_lines()
+        line_height = 16
+        top = SCREEN_HEIGHT - 75
+
+        while len(self.profiler_texts) < len(lines):
+            i = len(self.profiler_texts)
+            self.profiler_texts.append(arcade.Text("", SCREEN_WIDTH - 335, top - 20 - i * line_height, arcade.color.WHITE, 11,
+                                                   batch=self.profiler_batch))
+
+        for text, line in zip(self.profiler_texts, lines + [""] * (len(self.profiler_texts) - len(lines))):
+            if text.text != line:
+                text.text = line
+
+        arcade.draw_lrbt_rectangle_filled(SCREEN_WIDTH - 345, SCREEN_WIDTH - 5, top - len(lines) * line_height - 10, top, (0, 0, 0, 150))
+        self.profiler_batch.draw()
+
+    def create_key_instructions(self):
         instructions = [
             "Controls:",
             "H - Toggle cards and stats visibility",
             "D - Toggle one rabbit perception range",
+            "P / O - Toggle profiler / dump it to file",
+            "Arrows, right drag / wheel - Pan / zoom",
+            "F5 / F9 - Save / load checkpoint",
+            "1 / 2 / 3 / 4 - Speed 1x / 4x / 16x / max",
             "Mouse left click - Collect resource"
         ]
         
         start_x = 10
         start_y = SCREEN_HEIGHT - 80
         line_height = 20
-        
-        # Draw a background box for the instructions
-        arcade.draw_lrbt_rectangle_filled(5, 300, SCREEN_HEIGHT - 175, SCREEN_HEIGHT - 75, (0, 0, 0, 150))
 
-        for i, line in enumerate(instructions):
-            arcade.draw_text(
+        self.instruction_texts = [
+            arcade.Text(
                 line,
                 start_x,
                 start_y - i * line_height,
                 arcade.color.WHITE,
                 14,
-                bold=True
-            )
-        
-        if len(self.entities) == 0:
-            start_x = SCREEN_WIDTH / 2
-            start_y = SCREEN_HEIGHT / 2
-
-            arcade.draw_text(
-                "Game Over",
-                start_x,
-                start_y,
-                arcade.color.WHITE,
-                28,
                 bold=True,
-                anchor_x="center",
-                anchor_y="center"
+                batch=self.hud_batch
             )
+            for i, line in enumerate(instructions)
+        ]
+
+    def draw_key_instructions(self):
+        # Draw a background box for the instructions
+        arcade.draw_lrbt_rectangle_filled(5, 300, SCREEN_HEIGHT - 255, SCREEN_HEIGHT - 75, (0, 0, 0, 150))
+        self.hud_batch.draw()
+        
+        if len(self.simulation.entities) == 0:
+            self.game_over_text.draw()
         
     def on_update(self, delta_time):
-        self.spatial_grid.clear()
-        for prey in self.preys:
-            self.spatial_grid.add_sprite(prey)
-        self.entities.update()
-        self.prey_social_controller.update(delta_time)
+        if self.pan_keys:
+            distance = CAMERA_PAN_SPEED * delta_time / self.camera.zoom
+            dx = (arcade.key.RIGHT in self.pan_keys) - (arcade.key.LEFT in self.pan_keys)
+            dy = (arcade.key.UP in self.pan_keys) - (arcade.key.DOWN in self.pan_keys)
+            self.move_camera(dx * distance, dy * distance)
+
+        self.advance_simulation(delta_time)
+
+    def advance_simulation(self, delta_time):
+        # the simulation only ever steps by SIMULATION_TIMESTEP, as many times as the speed asks for this frame;
+        # when a frame runs out of UPDATE_TIME_BUDGET the rest is dropped and the simulation just runs slower
+        speed = SIMULATION_SPEEDS[self.speed_index]
+        clock = time.perf_counter
+        deadline = clock() + UPDATE_TIME_BUDGET
+
+        if speed is None:
+            self.step_accumulator = 0
+            self.simulation.step(SIMULATION_TIMESTEP)
+            while clock() < deadline:
+                self.simulation.step(SIMULATION_TIMESTEP)
+            return
+
+        self.step_accumulator += min(delta_time, MAX_FRAME_TIME) * speed
+        while self.step_accumulator >= SIMULATION_TIMESTEP:
+            self.simulation.step(SIMULATION_TIMESTEP)
+            self.step_accumulator -= SIMULATION_TIMESTEP
+            if clock() > deadline:
+                self.step_accumulator = 0
+
+    def set_speed(self, speed_index):
+        self.speed_index = speed_index
+        speed = SIMULATION_SPEEDS[speed_index]
+        self.speed_text.text = "speed: max" if speed is None else f"speed: {speed}x"
     
     def on_mouse_press(self, x, y, button, modifiers):
-        cards_clicked = arcade.get_sprites_at_point((x, y), self.cards)
+        cards_clicked = arcade.get_sprites_at_point((x, y), self.simulation.cards)
         
         if not self.hide_cards:
             for card in cards_clicked:
-                card.use()
+                self.simulation.handle_input("use_card", card.index)
                 return
 
-        sprites_clicked = arcade.get_sprites_at_point((x, y), self.entities)
+        if button == arcade.MOUSE_BUTTON_LEFT:
+            world_x, world_y, _ = self.camera.unproject((x, y))
+            self.simulation.handle_input("collect", world_x, world_y)
 
-        if len(sprites_clicked) > 0:
-            sprite_clicked = sorted(sprites_clicked, key=lambda entity: entity.bottom, reverse=False)[0]
-        else:
-            sprite_clicked = None
-        
-        if sprite_clicked is not None:
-            if sprite_clicked.type == LivingType.RABBIT:
-                self.resources_collected["rabbit"] += 1
-            
-            if sprite_clicked.type == LivingType.FOX:
-                self.resources_collected["fox"] += 1
-            
-            if sprite_clicked.type == LivingType.PLANT:
-                self.resources_collected["bush"] += 1
-            
-            if sprite_clicked.type == LivingType.GRASS:
-                self.resources_collected["grass"] += 1
+    def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
+        if buttons & arcade.MOUSE_BUTTON_RIGHT:
+            self.move_camera(-dx / self.camera.zoom, -dy / self.camera.zoom)
 
-            sprite_clicked.remove_from_sprite_lists()
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        self.zoom_camera(CAMERA_ZOOM_STEP ** scroll_y, x, y)
+
+    def on_key_release(self, key, modifiers):
+        self.pan_keys.discard(key)
 
     def on_key_press(self, key, modifiers):
+        self.simulation.handle_input("key", key)
+
+        if key in (arcade.key.LEFT, arcade.key.RIGHT, arcade.key.UP, arcade.key.DOWN):
+            self.pan_keys.add(key)
+
         if key == arcade.key.H:
             self.hide_cards = not self.hide_cards
         
         if key == arcade.key.D:
             self.is_debugging = not self.is_debugging
 
+        if key == arcade.key.P:
+            self.is_profiling = not self.is_profiling
+            self.simulation.profiler.enabled = self.is_profiling
+
+        if key == arcade.key.O:
+            self.simulation.profiler.dump(PROFILE_PATH)
+
+        if key == arcade.key.F5:
+            self.save_checkpoint(CHECKPOINT_PATH)
+
+        if key == arcade.key.F9 and os.path.isdir(CHECKPOINT_PATH):
+            self.load_checkpoint(CHECKPOINT_PATH)
+
+        if arcade.key.KEY_1 <= key < arcade.key.KEY_1 + len(SIMULATION_SPEEDS):
+            self.set_speed(key - arcade.key.KEY_1)
+
+    def save_checkpoint(self, path):
+        self.simulation.save_checkpoint(path)
+
+    def load_checkpoint(self, path):
+        # a recording replays from the world it started in, so it ends here
+        if self.record_path:
+            self.simulation.recorder.save(self.record_path)
+            self.record_path = None
+
+        previous = self.simulation
+        telemetry = previous.telemetry
+        self.simulation = Simulation.load_checkpoint(path)
+        self.simulation.profiler = previous.profiler
+        if telemetry:
+            telemetry.simulation = self.simulation
+            self.simulation.telemetry = telemetry
+        previous.phases.close()
+        self.simulation.start_parallel(previous.phases.workers)
+        self.move_camera(0, 0)
+
+    def on_close(self):
+        if self.record_path:
+            self.simulation.recorder.save(self.record_path)
+        if self.simulation.telemetry:
+            self.simulation.telemetry.close()
+        self.simulation.phases.close()
+        super().on_close()
+
 class SpatialHashGrid:
     def __init__(self, cell_size):
         self.cell_size = cell_size
         self.grid = {}
+        self.sprite_keys = {}
+        # bounding box of every key ever used, so ring searches know when to stop
+        self.bounds = None
 
     def clear(self):
         self.grid.clear()
+        self.sprite_keys.clear()
+        self.bounds = None
 
     def add_sprite(self, sprite):
         key = self._get_cell_key(sprite.center_x, sprite.center_y)
-        if key not in self.grid:
-            self.grid[key] = []
-        self.grid[key].append(sprite)
+        self._insert(sprite, key)
+
+    def add_sprites(self, sprites):
+        # add_sprite for many sprites, in the order given, with the bounds widened once
+        grid = self.grid
+        sprite_keys = self.sprite_keys
+        cell_size = self.cell_size
+        for sprite in sprites:
+            key = (int(sprite.center_x // cell_size), int(sprite.center_y // cell_size))
+            cell = grid.get(key)
+            if cell is None:
+                cell = grid[key] = {}
+            cell[sprite] = None
+            sprite_keys[sprite] = key
+
+        if not sprite_keys:
+            return
+        keys_x = [key[0] for key in grid]
+        keys_y = [key[1] for key in grid]
+        bounds = (min(keys_x), min(keys_y), max(keys_x), max(keys_y))
+        if self.bounds is not None:
+            bounds = (min(bounds[0], self.bounds[0]), min(bounds[1], self.bounds[1]), max(bounds[2], self.bounds[2]), max(bounds[3], self.bounds[3]))
+        self.bounds = bounds
+
+    def remove(self, sprite):
+        key = self.sprite_keys.pop(sprite, None)
+        if key is None:
+            return
+
+        cell = self.grid[key]
+        del cell[sprite]
+        if not cell:
+            del self.grid[key]
+
+    def move(self, sprite):
+        key = self._get_cell_key(sprite.center_x, sprite.center_y)
+        if self.sprite_keys.get(sprite) == key:
+            return
+
+        self.remove(sprite)
+        self._insert(sprite, key)
 
     def get_nearby_sprites(self, x, y):
         key = self._get_cell_key(x, y)
@@ -1200,20 +3007,156 @@ class SpatialHashGrid:
                     nearby_sprites.extend(self.grid[neighbor_key])
         return nearby_sprites
 
+    def query_radius(self, x, y, radius):
+        # lazily yields the sprites closer than radius, visiting only the cells the circle reaches
+        key_x, key_y = self._get_cell_key(x, y)
+        ring = math.ceil(radius / self.cell_size)
+        radius_square = radius * radius
+
+        for cell_x in range(key_x - ring, key_x + ring + 1):
+            for cell_y in range(key_y - ring, key_y + ring + 1):
+                cell = self.grid.get((cell_x, cell_y))
+                if not cell or self._cell_square_distance(x, y, cell_x, cell_y) >= radius_square:
+                    continue
+
+                for sprite in cell:
+                    dx = sprite.center_x - x
+                    dy = sprite.center_y - y
+                    if dx * dx + dy * dy < radius_square:
+                        yield sprite
+
+    def query_rect(self, left, bottom, right, top):
+        # sprites inside the rectangle, only the cells it overlaps are visited
+        min_x, min_y = self._get_cell_key(left, bottom)
+        max_x, max_y = self._get_cell_key(right, top)
+        if self.bounds is not None:
+            min_x, min_y = max(min_x, self.bounds[0]), max(min_y, self.bounds[1])
+            max_x, max_y = min(max_x, self.bounds[2]), min(max_y, self.bounds[3])
+
+        grid = self.grid
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = grid.get((cell_x, cell_y))
+                if not cell:
+                    continue
+
+                for sprite in cell:
+                    if left <= sprite.center_x <= right and bottom <= sprite.center_y <= top:
+                        yield sprite
+
+    def nearest(self, x, y, predicate=None, max_radius=None):
+        if self.bounds is None:
+            return None
+
+        key_x, key_y = self._get_cell_key(x, y)
+        min_x, min_y, max_x, max_y = self.bounds
+        last_ring = max(key_x - min_x, max_x - key_x, key_y - min_y, max_y - key_y)
+        if max_radius is not None:
+            last_ring = min(last_ring, math.ceil(max_radius / self.cell_size))
+
+        nearest_sprite = None
+        nearest_square_distance = float("inf") if max_radius is None else max_radius * max_radius
+
+        for ring in range(last_ring + 1):
+            # every cell of this ring or beyond is at least (ring - 1) cells away from the point
+            ring_distance = (ring - 1) * self.cell_size
+            if ring_distance > 0 and ring_distance * ring_distance >= nearest_square_distance:
+                break
+
+            for cell_x, cell_y in self._ring_keys(key_x, key_y, ring):
+                cell = self.grid.get((cell_x, cell_y))
+                if not cell:
+                    continue
+
+                for sprite in cell:
+                    dx = sprite.center_x - x
+                    dy = sprite.center_y - y
+                    square_distance = dx * dx + dy * dy
+                    if square_distance < nearest_square_distance and (predicate is None or predicate(sprite)):
+                        nearest_sprite = sprite
+                        nearest_square_distance = square_distance
+
+        return nearest_sprite
+
+    def _insert(self, sprite, key):
+        if key not in self.grid:
+            self.grid[key] = {}
+        self.grid[key][sprite] = None
+        self.sprite_keys[sprite] = key
+
+        if self.bounds is None:
+            self.bounds = (key[0], key[1], key[0], key[1])
+        else:
+            min_x, min_y, max_x, max_y = self.bounds
+            self.bounds = (min(min_x, key[0]), min(min_y, key[1]), max(max_x, key[0]), max(max_y, key[1]))
+
+    def _ring_keys(self, key_x, key_y, ring):
+        if ring == 0:
+            yield key_x, key_y
+            return
+
+        for cell_x in range(key_x - ring, key_x + ring + 1):
+            yield cell_x, key_y - ring
+            yield cell_x, key_y + ring
+        for cell_y in range(key_y - ring + 1, key_y + ring):
+            yield key_x - ring, cell_y
+            yield key_x + ring, cell_y
+
+    def _cell_square_distance(self, x, y, cell_x, cell_y):
+        left = cell_x * self.cell_size
+        bottom = cell_y * self.cell_size
+        dx = max(left - x, 0, x - (left + self.cell_size))
+        dy = max(bottom - y, 0, y - (bottom + self.cell_size))
+        return dx * dx + dy * dy
+
     def _get_cell_key(self, x, y):
         return (int(x // self.cell_size), int(y // self.cell_size))
 
 # utils functions
+def init_sprite(sprite, texture, scale, center_x, center_y):
+    # what arcade.Sprite.__init__ sets up, for the entities a checkpoint load makes in bulk;
+    # test_simulation compares it with the real constructor
+    position = (center_x, center_y)
+    sprite._position = position
+    sprite._depth = 0.0
+    sprite._texture = texture
+    sprite._scale = (scale, scale)
+    sprite._width = texture.width * scale
+    sprite._height = texture.height * scale
+    sprite._visible = True
+    sprite._color = arcade.color.WHITE
+    sprite.sprite_lists = []
+    sprite._angle = 0.0
+    sprite._velocity = (0.0, 0.0)
+    sprite.change_angle = 0.0
+    sprite._properties = None
+    sprite.boundary_left = sprite.boundary_right = sprite.boundary_top = sprite.boundary_bottom = None
+    sprite.cur_texture_index = 0
+    sprite.textures = [texture]
+    sprite.physics_engines = []
+    sprite.guid = None
+    sprite._hit_box = arcade.hitbox.RotatableHitBox(texture.hit_box_points, position=position, scale=sprite._scale, angle=0.0)
+    sprite.pymunk = arcade.sprite.mixins.PyMunk()
+    sprite.force = [0.0, 0.0]
+
+@functools.cache
+def entity_texture(path):
+    # resolving an image path costs more than the rest of a sprite constructor, so every spawn shares one texture
+    return arcade.load_texture(path)
+
+def is_alive(living_being):
+    return living_being.current_state != LivingBeingStates.DEAD
+
 def get_square_distance(center_x, center_y, target_center_x, target_center_y):
         dx = center_x - target_center_x
         dy = center_y - target_center_y
         return dx * dx + dy * dy 
 
-def random_int_xy(limitRangeX, limitRangeY):
+def random_int_xy(limitRangeX, limitRangeY, rng=random):
     lowerLimitRangeX, upperLimitRangeX = limitRangeX
     lowerLimitRangeY, upperLimitRangeY = limitRangeY
 
-    return random.randint(lowerLimitRangeX, upperLimitRangeX), random.randint(lowerLimitRangeY, upperLimitRangeY) 
+    return rng.randint(lowerLimitRangeX, upperLimitRangeX), rng.randint(lowerLimitRangeY, upperLimitRangeY) 
 
 def limit_vector(vector, max_value):
     magnitude = math.hypot(vector[0], vector[1])
@@ -1221,6 +3164,116 @@ def limit_vector(vector, max_value):
         vector[0] = (vector[0] / magnitude) * max_value
         vector[1] = (vector[1] / magnitude) * max_value
 
+def limit_vectors(xs, ys, max_value):
+    magnitude = np.hypot(xs, ys)
+    too_long = magnitude > max_value
+    scale = max_value / magnitude[too_long]
+    xs[too_long] *= scale
+    ys[too_long] *= scale
+
+def find_neighbour_pairs(xs, ys, radius):
+    # every (i, j) pair, i != j, whose cells of size radius touch; callers filter by distance
+    cell_x = np.floor(xs / radius).astype(np.int64)
+    cell_y = np.floor(ys / radius).astype(np.int64)
+    cell_y -= cell_y.min() - 1
+    span = cell_y.max() + 2
+    keys = cell_x * span + cell_y
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs_i = []
+    pairs_j = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour_keys = keys + dx * span + dy
+            starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+            counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - starts
+
+            total = counts.sum()
+            if total == 0:
+                continue
+
+            run_starts = np.cumsum(counts) - counts
+            offsets = np.arange(total) - np.repeat(run_starts, counts)
+            pairs_i.append(np.repeat(np.arange(len(xs)), counts))
+            pairs_j.append(order[np.repeat(starts, counts) + offsets])
+
+    if not pairs_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    different = i != j
+    return i[different], j[different]
+
 if __name__ == '__main__':
-    app = EcosystemSimulator()
-    arcade.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--headless", action="store_true", help="run the simulation without opening a window")
+    parser.add_argument("--ticks", type=int, default=3600, help="number of ticks to run in headless mode")
+    parser.add_argument("--seed", type=int, help="seed of the simulation random stream")
+    parser.add_argument("--world-scale", type=float, default=1, help="world size in screens per side, populated at the default density")
+    parser.add_argument("--record", metavar="PATH", help="save the seed and every input of the session to PATH")
+    parser.add_argument("--replay", metavar="PATH", help="re-run a recorded session headlessly at maximum speed")
+    parser.add_argument("--load-checkpoint", metavar="PATH", help="start from a checkpoint instead of a new world")
+    parser.add_argument("--save-checkpoint", metavar="PATH", help="save a checkpoint when the headless run ends")
+    parser.add_argument("--telemetry", metavar="PATH", help="stream population metrics to a .csv, .npy or .parquet file")
+    parser.add_argument("--telemetry-interval", type=int, default=10, help="ticks between two telemetry samples")
+    parser.add_argument("--profile", metavar="PATH", help="profile every step and dump the percentiles to PATH")
+    parser.add_argument("--profile-by-class", action="store_true",
+                        help="also time the entity updates of every class, which slows down the updates being profiled")
+    parser.add_argument("--sleep", action="store_true",
+                        help="let quiet chunks sleep between staggered updates, faster but the results differ from a full update")
+    parser.add_argument("--workers", type=int, help="sense entities in chunk partitions on this many threads, "
+                                                    "only used on a free-threaded build")
+    args = parser.parse_args()
+
+    if args.replay:
+        log = InputRecorder.load(args.replay)
+        start = time.perf_counter()
+        simulation = Simulation.replay(log)
+        elapsed = time.perf_counter() - start
+        ticks = len(log["delta_times"])
+        print(f"replayed {ticks} ticks in {elapsed:.2f}s ({ticks / elapsed:.0f} ticks/s) - "
+              f"state {simulation.state_digest()}")
+    elif args.headless:
+        simulation = Simulation.load_checkpoint(args.load_checkpoint) if args.load_checkpoint else Simulation.with_world_scale(args.world_scale, args.seed)
+        if args.sleep:
+            simulation.sleeping_enabled = True
+        if args.workers:
+            simulation.start_parallel(args.workers)
+        if args.record:
+            simulation.start_recording()
+        if args.telemetry:
+            simulation.start_telemetry(args.telemetry, args.telemetry_interval)
+        if args.profile:
+            simulation.start_profiling(args.profile_by_class)
+
+        start = time.perf_counter()
+        simulation.run(args.ticks)
+        elapsed = time.perf_counter() - start
+        print(f"{args.ticks} ticks in {elapsed:.2f}s ({args.ticks / elapsed:.0f} ticks/s) - "
+              f"preys: {len(simulation.preys)}, predators: {len(simulation.predators)}, "
+              f"bushes: {len(simulation.bushes)}, grass: {len(simulation.grass_patches)} - "
+              f"state {simulation.state_digest()}")
+
+        if args.record:
+            simulation.recorder.save(args.record)
+        if args.save_checkpoint:
+            simulation.save_checkpoint(args.save_checkpoint)
+        if args.telemetry:
+            simulation.telemetry.close()
+        if args.profile:
+            simulation.profiler.dump(args.profile)
+        simulation.phases.close()
+    else:
+        simulation = Simulation.load_checkpoint(args.load_checkpoint) if args.load_checkpoint else Simulation.with_world_scale(args.world_scale, args.seed)
+        if args.sleep:
+            simulation.sleeping_enabled = True
+        if args.workers:
+            simulation.start_parallel(args.workers)
+        if args.telemetry:
+            simulation.start_telemetry(args.telemetry, args.telemetry_interval)
+        simulation.profiler.by_class = args.profile_by_class
+        app = EcosystemSimulator(simulation, record_path=args.record)
+        arcade.run()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import main
+
+SPECIES = [living_type.name.lower() for living_type in main.LivingType]
+# constants main.py computes from other constants at import, recomputed after every override so the whole
+# model sees the swept values; they cannot be swept themselves
+DERIVED_CONSTANTS = {
+    "PREY_DETECTION_RANGE": lambda: math.sqrt(main.DETECTION_RANGE * main.DETECTION_RANGE + 25),
+    "GRID_OFFSET_X": lambda: main.SCREEN_WIDTH / main.GRID_UNIT_X,
+    "GRID_OFFSET_Y": lambda: main.SCREEN_HEIGHT / main.GRID_UNIT_Y,
+}
+# the window size is also the default world size, sweep WORLD_WIDTH and WORLD_HEIGHT instead
+WINDOW_CONSTANTS = ("SCREEN_WIDTH", "SCREEN_HEIGHT")
+
+def parse_parameter(text):
+    name, _, values = text.partition("=")
+    if not values:
+        raise argparse.ArgumentTypeError(f"expected NAME=v1,v2,... or NAME=low:high, got {text!r}")
+
+    if ":" in values:
+        low, high = values.split(":")
+        return name, (float(low), float(high))
+
+    return name, [parse_number(value) for value in values.split(",")]
+
+def parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def grid_parameter_sets(parameters):
+    for name, values in parameters.items():
+        if isinstance(values, tuple):
+            raise ValueError(f"{name} is a range, ranges can only be used with --samples")
+
+    names = list(parameters)
+    for values in itertools.product(*(parameters[name] for name in names)):
+        yield dict(zip(names, values))
+
+def random_parameter_sets(parameters, samples, rng):
+    for _ in range(samples):
+        parameter_set = {}
+        for name, values in parameters.items():
+            if isinstance(values, tuple):
+                parameter_set[name] = rng.uniform(*values)
+            else:
+                parameter_set[name] = rng.choice(values)
+        yield parameter_set
+
+def run_simulation(task):
+    parameters, seed, ticks, delta_time = task
+
+    # constants are module globals of main, worker processes are reused so they are restored after every run
+    constants = {name: value for name, value in parameters.items() if name.isupper()}
+    defaults = {name: getattr(main, name) for name in [*constants, *DERIVED_CONSTANTS]}
+
+    try:
+        for name, value in constants.items():
+            setattr(main, name, value)
+        for name, derive in DERIVED_CONSTANTS.items():
+            setattr(main, name, derive())
+
+        # the world size defaults of Simulation were read at import, so the swept ones are passed
+        simulation = main.Simulation(seed=seed, world_width=main.WORLD_WIDTH, world_height=main.WORLD_HEIGHT)
+
+        controller = simulation.prey_social_controller
+        for name, value in parameters.items():
+            if not name.isupper():
+                setattr(controller, name, value)
+
+        populations = np.zeros((ticks + 1, len(SPECIES)), dtype=np.int32)
+        populations[0] = simulation.population_counts()
+        extinction_tick = -1
+
+        for tick in range(1, ticks + 1):
+            simulation.step(delta_time)
+            populations[tick] = simulation.population_counts()
+
+            if extinction_tick < 0 and (populations[tick, 0] == 0 or populations[tick, 1] == 0):
+                extinction_tick = tick
+
+            if not simulation.entities:
+                break
+
+        return populations, extinction_tick
+    finally:
+        for name, value in defaults.items():
+            setattr(main, name, value)
+
+def validate_parameters(parameters):
+    controller_attributes = ("max_speed", "perception_radius", "separation_radius",
+                             "separation_weight", "alignment_weight", "cohesion_weight")
+    for name in parameters:
+        if name.isupper() and not hasattr(main, name):
+            raise ValueError(f"unknown constant {name}")
+        if name in DERIVED_CONSTANTS:
+            raise ValueError(f"{name} is computed from other constants, sweep those instead")
+        if name in WINDOW_CONSTANTS:
+            raise ValueError(f"{name} only sizes the window, sweep WORLD_WIDTH and WORLD_HEIGHT instead")
+        if not name.isupper() and name not in controller_attributes:
+            raise ValueError(f"unknown PreySocialController parameter {name}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run headless parameter sweeps of the ecosystem simulator")
+    parser.add_argument("--param", type=parse_parameter, action="append", default=[],
+                        help="NAME=v1,v2,... (grid) or NAME=low:high (random samples only), "
+                             "upper case names are main.py constants, lower case ones PreySocialController attributes")
+    parser.add_argument("--samples", type=int, default=0, help="draw this many random parameter sets instead of the full grid")
+    parser.add_argument("--seeds", type=int, default=4, help="runs per parameter set")
+    parser.add_argument("--base-seed", type=int, default=0)
+    parser.add_argument("--ticks", type=int, default=36000)
+    parser.add_argument("--delta-time", type=float, default=1 / 60)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep_results.npz")
+    args = parser.parse_args()
+
+    parameters = dict(args.param)
+    validate_parameters(parameters)
+
+    if args.samples:
+        parameter_sets = list(random_parameter_sets(parameters, args.samples, random.Random(args.base_seed)))
+    else:
+        parameter_sets = list(grid_parameter_sets(parameters))
+
+    seeds = list(range(args.base_seed, args.base_seed + args.seeds))
+    tasks = [(parameter_set, seed, args.ticks, args.delta_time) for parameter_set in parameter_sets for seed in seeds]
+    print(f"{len(parameter_sets)} parameter sets x {len(seeds)} seeds = {len(tasks)} runs on {args.workers} workers")
+
+    populations = np.zeros((len(tasks), args.ticks + 1, len(SPECIES)), dtype=np.int32)
+    extinction_ticks = np.full(len(tasks), -1, dtype=np.int64)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_simulation, task): index for index, task in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            populations[index], extinction_ticks[index] = future.result()
+            print(f"[{done}/{len(tasks)}] {tasks[index][0]} seed {tasks[index][1]}: "
+                  f"extinction tick {extinction_ticks[index]} ({time.perf_counter() - start:.0f}s)")
+
+    columns = {f"param_{name}": np.array([task[0][name] for task in tasks]) for name in parameters}
+    np.savez_compressed(args.output,
+                        populations=populations,
+                        extinction_tick=extinction_ticks,
+                        seed=np.array([task[1] for task in tasks]),
+                        species=np.array(SPECIES),
+                        delta_time=args.delta_time,
+                        **columns)
+    print(f"results written to {args.output}")
@@ -0,0 +1,192 @@
+import gc
+import os
+import random
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import main
+
+class CheckpointTest(unittest.TestCase):
+    def assert_continues_identically(self, simulation, ticks=300):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint")
+            simulation.save_checkpoint(path)
+            restored = main.Simulation.load_checkpoint(path)
+
+        simulation.run(ticks)
+        restored.run(ticks)
+        self.assertEqual(simulation.state_digest(), restored.state_digest())
+
+    def test_round_trip(self):
+        simulation = main.Simulation(seed=3)
+        simulation.run(500)
+        self.assert_continues_identically(simulation)
+
+    def test_round_trip_with_detached_target(self):
+        # an animal still following an entity that was already removed from the world
+        simulation = main.Simulation(seed=7)
+        for _ in range(3000):
+            simulation.step()
+            if any(getattr(entity, "current_target_object", None) is not None and entity.current_target_object.slot is None
+                   for entity in simulation.entities):
+                break
+        else:
+            self.skipTest("no detached target came up")
+
+        self.assert_continues_identically(simulation)
+
+    def test_restore_sets_up_the_sprite_like_the_constructor(self):
+        # LivingBeing.restore goes around arcade.Sprite.__init__, so it has to leave the same sprite state behind
+        def sprite_state(sprite):
+            hit_box, pymunk = sprite._hit_box, sprite.pymunk
+            return {
+                **{name: getattr(sprite, name) for name in names},
+                "_hit_box": (type(hit_box), hit_box.points, hit_box.position, hit_box.scale, hit_box.angle),
+                "pymunk": (type(pymunk), [getattr(pymunk, name) for name in pymunk.__slots__]),
+            }
+
+        names = [name for klass in main.arcade.Sprite.__mro__ for name in getattr(klass, "__slots__", ())
+                 if name not in ("__weakref__", "_hit_box")]
+        simulation = main.Simulation(seed=3, populate=False)
+        for entity_class in (main.PreySprite, main.PredatorSprite, main.BushSprite, main.GrassPatchSprite):
+            with self.subTest(entity_class=entity_class.__name__):
+                built = entity_class(120.5, 48.25, simulation)
+                restored = entity_class.restore(simulation, 120.5, 48.25)
+                self.assertEqual(sprite_state(restored), sprite_state(built))
+
+    def test_load_time(self):
+        # a world of 50k entities has to load well under a second, the best of a few loads evens out a busy machine
+        simulation = main.Simulation.with_world_scale(17.5, seed=3)
+        self.assertGreaterEqual(len(simulation.entities), 50000)
+
+        timings = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint")
+            simulation.save_checkpoint(path)
+            for _ in range(5):
+                # the previous load is collected first, so every load starts from the same heap
+                restored = None
+                gc.collect()
+                start = time.perf_counter()
+                restored = main.Simulation.load_checkpoint(path)
+                timings.append(time.perf_counter() - start)
+
+        self.assertEqual(restored.state_digest(), simulation.state_digest())
+        self.assertLess(min(timings), 1.0)
+
+class PlantTest(unittest.TestCase):
+    def test_no_reproduction_on_the_tick_of_death(self):
+        simulation = main.Simulation(seed=3)
+        bush = simulation.bushes[0]
+        bush.routines_interval[main.PlantRoutine.REPRODUCTIVE_INTERVAL.value] = -1
+        bush.routines_interval[main.PlantRoutine.LIFE_EXPECTANCY.value] = -1
+        plants = simulation.population.count(main.LivingType.PLANT)
+
+        simulation.phases.sense([bush], lambda entity: entity.update(main.SIMULATION_TIMESTEP))
+        simulation.phases.act()
+
+        self.assertEqual(bush.current_state, main.LivingBeingStates.DEAD)
+        self.assertEqual(len(simulation.bushes), plants)
+
+class FlockingTest(unittest.TestCase):
+    def test_flock_all_matches_flock(self):
+        simulation = main.Simulation(seed=3)
+        simulation.run(300)
+        controller = simulation.prey_social_controller
+        for prey in simulation.preys:
+            simulation.spatial_grid.move(prey)
+
+        # every prey flocked on its own from the same snapshot of velocities
+        velocities = {prey: (prey.velocity_x, prey.velocity_y) for prey in simulation.preys}
+        expected = {}
+        for prey in simulation.preys:
+            controller.flock(prey, main.SIMULATION_TIMESTEP)
+            expected[prey] = (prey.velocity_x, prey.velocity_y)
+            prey.velocity_x, prey.velocity_y = velocities[prey]
+
+        controller.flock_all(main.SIMULATION_TIMESTEP)
+        for prey, (velocity_x, velocity_y) in expected.items():
+            self.assertAlmostEqual(prey.velocity_x, velocity_x, places=9)
+            self.assertAlmostEqual(prey.velocity_y, velocity_y, places=9)
+
+class Point:
+    def __init__(self, center_x, center_y, alive=True):
+        self.center_x = center_x
+        self.center_y = center_y
+        self.alive = alive
+
+class SpatialHashGridTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(5)
+        self.grid = main.SpatialHashGrid(cell_size=40)
+        self.points = [Point(self.random.uniform(-100, 900), self.random.uniform(-100, 700), self.random.random() < 0.7)
+                       for _ in range(400)]
+        for point in self.points:
+            self.grid.add_sprite(point)
+
+        # queries have to follow points that moved to other cells or left the grid
+        for point in self.random.sample(self.points, 150):
+            point.center_x += self.random.uniform(-200, 200)
+            point.center_y += self.random.uniform(-200, 200)
+            self.grid.move(point)
+        for point in self.random.sample(self.points, 50):
+            self.grid.remove(point)
+            self.points.remove(point)
+
+    def queries(self):
+        for _ in range(50):
+            yield self.random.uniform(-150, 950), self.random.uniform(-150, 750), self.random.choice([5, 40, 75, 130, 500])
+
+    def test_query_radius(self):
+        for x, y, radius in self.queries():
+            expected = {point for point in self.points if (point.center_x - x) ** 2 + (point.center_y - y) ** 2 < radius * radius}
+            self.assertEqual(set(self.grid.query_radius(x, y, radius)), expected)
+
+    def test_query_rect(self):
+        for x, y, size in self.queries():
+            left, bottom, right, top = x - size, y - size / 2, x + size / 2, y + size
+            expected = {point for point in self.points
+                        if left <= point.center_x <= right and bottom <= point.center_y <= top}
+            self.assertEqual(set(self.grid.query_rect(left, bottom, right, top)), expected)
+
+    def test_nearest(self):
+        def square_distance(point, x, y):
+            return (point.center_x - x) ** 2 + (point.center_y - y) ** 2
+
+        for x, y, max_radius in self.queries():
+            for predicate in (None, lambda point: point.alive):
+                for radius in (None, max_radius):
+                    candidates = [point for point in self.points if predicate is None or predicate(point)]
+                    if radius is not None:
+                        candidates = [point for point in candidates if square_distance(point, x, y) < radius * radius]
+
+                    nearest = self.grid.nearest(x, y, predicate, radius)
+                    if not candidates:
+                        self.assertIsNone(nearest)
+                        continue
+                    # ties may resolve to either point, the distance is what has to match
+                    self.assertEqual(square_distance(nearest, x, y), min(square_distance(point, x, y) for point in candidates))
+
+class ParallelUpdateTest(unittest.TestCase):
+    def test_threads_match_serial(self):
+        # the threads only pay off on a free-threaded build, but they have to give the same results on any build
+        for sleeping in (False, True):
+            with self.subTest(sleeping=sleeping):
+                digests = []
+                for workers in (1, 4):
+                    simulation = main.Simulation.with_world_scale(2, seed=3)
+                    simulation.sleeping_enabled = sleeping
+                    with unittest.mock.patch("main.free_threaded", return_value=True):
+                        simulation.phases.set_workers(workers)
+                    self.assertEqual(simulation.phases.workers, workers)
+                    try:
+                        simulation.run(500)
+                    finally:
+                        simulation.phases.close()
+                    digests.append(simulation.state_digest())
+                self.assertEqual(digests[0], digests[1])
+
+if __name__ == '__main__':
+    unittest.main()